@@ -1,20 +1,16 @@
 import streamlit as st
-import pandas as pd
-import re
-from collections import Counter
-from openpyxl import Workbook
-from openpyxl.styles import numbers
-from io import BytesIO
-
-# Mapping dictionaries (unchanged)
-OH_map = {'G': 'Go', '4': '4 OOS', 'R': 'Red', '5': '5 OOS', 'I': 'Rip', '2': '2', 'Y': 'Boy'}
-MB_map = {'3': '3', '1': '1/Fix', 'A': 'A', 'B': 'Push A', 'C': 'C/Slide', '2': '2', 'G': 'Go', 'R': 'Red', 'E': 'None'}
-OPP_map = {'G': 'Go', '4': '4 OOS', 'R': 'Red', '5': '5 OOS', 'I': 'Rip', '2': '2', 'Y': 'Boy', 'A': 'A', 'S': 'Dump'}
-BR_map = {'8': 'Bic/Pipe', '7': 'Gap', '9': 'Sky/D', 'W': 'A', 'M': 'MB', '0': 'None'}
-rotation_mapping = {
-    '*z1': 'Rotation 1', '*z6': 'Rotation 2', '*z5': 'Rotation 3',
-    '*z4': 'Rotation 4', '*z3': 'Rotation 5', '*z2': 'Rotation 6'
-}
+import logging
+import os
+import sys
+import zipfile
+from pathlib import Path
+
+from vs_core import (
+    ARCHIVE_CACHE_SIZE, cli, create_excel_in_memory, EventIndex, export_archive, EXPORT_FORMATS, export_tables,
+    file_hash, ingest_archive, ingest_matches, LiveMatch, logger, make_ingest_pool, ParsedMatchCache,
+    PipelineProfiler, report_key, ReportCache, ReportJobManager, rotation_mapping, SeasonStore, SET_ODDS_COLUMNS,
+    set_odds_table, share_table, sheet_blocks, SHEET_BLOCKS, tally_table,
+)
 
 # List of teams (up to 35, starting with Stanford)
 TEAMS = [
@@ -27,508 +23,328 @@ TEAMS = [
     "Team 31", "Team 32", "Team 33", "Team 34", "Team 35"
 ]
 
-# Helper Functions (unchanged except where noted)
-def parse_dvw_header(content):
-    lines = content.split('\n')
-    match_date = "01.01"
-    home_team = "Unknown Home"
-    away_team = "Unknown Away"
-    for i, line in enumerate(lines):
-        if line.strip().startswith('[3MATCH]'):
-            try:
-                match_line = lines[i + 1].strip()
-                if match_line:
-                    date_part = match_line.split(';')[0]
-                    day, month, _ = date_part.split('/')
-                    match_date = f"{month}.{day}"
-            except (IndexError, ValueError):
-                st.warning(f"Invalid date format: {date_part}")
-        elif line.strip().startswith('[3TEAMS]'):
-            try:
-                for j in range(i + 1, len(lines)):
-                    teams_line = lines[j].strip()
-                    if teams_line and not teams_line.startswith(';'):
-                        teams = teams_line.split(';')
-                        if len(teams) >= 3:
-                            if home_team == "Unknown Home":
-                                home_team = teams[1].strip()
-                            else:
-                                away_team = teams[1].strip()
-                                break
-            except IndexError:
-                st.warning("Could not parse teams")
-    return match_date, home_team, away_team
-
-def extract_custom_code(line):
-    pre_semicolon = line.split(';')[0]
-    parts = pre_semicolon.split('~')
-    return parts[-1] if parts else ""
-
-def extract_reception(content, match_name):
-    lines = content.split('\n')
-    z_code = None
-    receptions = []
-    for line in lines:
-        if z_match := re.search(r'\*z\d+', line):
-            z_code = z_match.group(0)
-        if z_code and (r_matches := re.findall(r'\*\d{2}R.*?;', line)):
-            for r_code in r_matches:
-                passer_str = r_code[1:3].strip()
-                passer = int(passer_str) if passer_str.isdigit() else passer_str
-                pass_grade = r_code[3] + r_code[5]
-                custom_code = extract_custom_code(r_code)
-                if pass_grade == 'R-' and len(custom_code) == 1 and custom_code in '45789M':
-                    receptions.append((match_name, z_code, passer, pass_grade, custom_code))
-                elif pass_grade in ['R#', 'R+', 'R!'] and len(custom_code) == 5 and custom_code.isalnum():
-                    receptions.append((match_name, z_code, passer, pass_grade, custom_code))
-    return receptions
-
-def extract_transition(content, match_name):
-    lines = content.split('\n')
-    transitions = []
-    z_code = None
-    for i in range(2, len(lines)):
-        if z_match := re.search(r'\*z\d+', lines[i-2]):
-            z_code = z_match.group(0)
-        if re.search(r'\*\d{2}[DF]', lines[i-2]) and (a_match := re.search(r'\*\d{2}A', lines[i])):
-            attacker_str = a_match.group(0)[1:3].strip()
-            attacker = int(attacker_str) if attacker_str.isdigit() else attacker_str
-            custom_code = extract_custom_code(lines[i])
-            if len(custom_code) == 5 and custom_code.isalnum():
-                transitions.append((match_name, z_code, attacker, custom_code))
-            elif len(custom_code) == 1 and custom_code in '45789M':
-                transitions.append((match_name, z_code, attacker, custom_code))
-    return transitions
-
-def parse_in_system(pattern):
-    if len(pattern) != 5 or not pattern.isalnum():
-        return None
-    oh_code, mb_code, opp_code, br_code, set_code = pattern
-    oh = OH_map.get(oh_code, oh_code)
-    mb = MB_map.get(mb_code, mb_code)
-    opp = OPP_map.get(opp_code, opp_code)
-    br = BR_map.get(br_code, br_code)
-    if set_code == oh_code:
-        set_to = oh
-    elif set_code == mb_code:
-        set_to = mb
-    elif set_code == opp_code:
-        set_to = opp
-    elif set_code == br_code:
-        set_to = br
-    else:
-        return None
-    return {'OH': oh, 'MB': mb, 'OPP/S': opp, 'BR': br, 'set_to': set_to}
-
-def parse_out_of_system(code):
-    mapping = {'4': 'OH', '5': 'RS', 'M': 'MB', '7': 'BR', '8': 'BR', '9': 'BR'}
-    return mapping.get(code)
-
-def analyze_reception(df, rotation):
-    rec_df = df[df['Reception Rotation'] == rotation]
-    tallies = {}
-    for cat in ['R#', 'R# or R+', 'R!']:
-        if cat == 'R# or R+':
-            group = rec_df[rec_df['Pass Grade'].isin(['R#', 'R+'])]
-        else:
-            group = rec_df[rec_df['Pass Grade'] == cat]
-        cat_tallies = Counter()
-        for code in group['Reception Custom Code']:
-            parsed = parse_in_system(code)
-            if parsed:
-                key = (parsed['OH'], parsed['MB'], parsed['OPP/S'], parsed['BR'], parsed['set_to'])
-                cat_tallies[key] += 1
-        tallies[cat] = cat_tallies
-    out_system = Counter(
-        parse_out_of_system(code) for code in rec_df[rec_df['Pass Grade'] == 'R-']['Reception Custom Code']
-        if parse_out_of_system(code)
-    )
-    tallies['R-'] = out_system
-    return tallies
-
-def analyze_transition(df, rotation):
-    trans_df = df[df['Transition Rotation'] == rotation]
-    in_system = Counter()
-    out_system = Counter()
-    for code in trans_df['Transition Custom Code']:
-        if len(code) == 5:
-            parsed = parse_in_system(code)
-            if parsed:
-                key = (parsed['OH'], parsed['MB'], parsed['OPP/S'], parsed['BR'], parsed['set_to'])
-                in_system[key] += 1
-        elif len(code) == 1:
-            pos = parse_out_of_system(code)
-            if pos:
-                out_system[pos] += 1
-    return in_system, out_system
-
-def create_excel_in_memory(df, oh1_num, oh2_num, home_team):
-    # (Unchanged Excel generation code - same as original)
-    df['Passer #'] = df['Passer #'].astype(str)
-    wb = Workbook()
-    wb.remove(wb.active)
-
-    for z_code, sheet_name in rotation_mapping.items():
-        ws = wb.create_sheet(sheet_name)
-        rec_df = df[df['Reception Rotation'] == z_code][[
-            'Reception Match Name', 'Reception Rotation', 'Passer #', 'Pass Grade', 'Reception Custom Code'
-        ]].dropna()
-        ws['N1'] = 'Reception Raw Data'
-        ws['N2'] = 'Match Name'
-        ws['O2'] = 'Rotation'
-        ws['P2'] = 'Passer #'
-        ws['Q2'] = 'Pass Grade'
-        ws['R2'] = 'Custom Code'
-        for r, data in enumerate(rec_df.itertuples(), start=3):
-            ws.cell(row=r, column=14, value=data._1)
-            ws.cell(row=r, column=15, value=data._2)
-            passer_val = data._3
-            if isinstance(passer_val, (int, float)):
-                passer_numeric = float(passer_val)
-            elif isinstance(passer_val, str) and passer_val.strip().replace('-', '').replace('.', '').isdigit():
-                passer_numeric = float(passer_val.strip())
-            else:
-                passer_numeric = None
-            cell_passer = ws.cell(row=r, column=16, value=passer_numeric if passer_numeric is not None else passer_val)
-            if passer_numeric is not None:
-                cell_passer.number_format = "General"
-            ws.cell(row=r, column=17, value=data._4)
-            ws.cell(row=r, column=18, value=data._5)
-
-        trans_df = df[df['Transition Rotation'] == z_code][[
-            'Transition Match Name', 'Transition Rotation', 'Attacker #', 'Transition Custom Code'
-        ]].dropna()
-        ws['T1'] = 'Transition Raw Data'
-        ws['T2'] = 'Match Name'
-        ws['U2'] = 'Rotation'
-        ws['V2'] = 'Attacker #'
-        ws['W2'] = 'Custom Code'
-        for r, data in enumerate(trans_df.itertuples(), start=3):
-            ws.cell(row=r, column=20, value=data._1)
-            ws.cell(row=r, column=21, value=data._2)
-            attacker_val = data._3
-            if isinstance(attacker_val, (int, float)):
-                attacker_numeric = float(attacker_val)
-            elif isinstance(attacker_val, str) and attacker_val.strip().replace('-', '').replace('.', '').isdigit():
-                attacker_numeric = float(attacker_val.strip())
-            else:
-                attacker_numeric = None
-            cell_attacker = ws.cell(row=r, column=22, value=attacker_numeric if attacker_numeric is not None else attacker_val)
-            if attacker_numeric is not None:
-                cell_attacker.number_format = "General"
-            ws.cell(row=r, column=23, value=data._4)
-
-        rec_tallies = analyze_reception(df, z_code)
-        trans_in_system, trans_out_system = analyze_transition(df, z_code)
-
-        row = 1
-        for cat in ['R#', 'R# or R+', 'R!']:
-            ws[f'A{row}'] = f'Reception {cat}'
-            row += 1
-            tallies = rec_tallies[cat]
-            if tallies:
-                ws[f'A{row}'] = 'OH'
-                ws[f'B{row}'] = 'MB'
-                ws[f'C{row}'] = 'OPP/S'
-                ws[f'D{row}'] = 'BR'
-                ws[f'E{row}'] = 'Set To'
-                ws[f'F{row}'] = 'Count'
-                row += 1
-                for (oh, mb, opp, br, set_to), count in sorted(tallies.items(), key=lambda x: x[0]):
-                    ws.cell(row=row, column=1, value=oh)
-                    ws.cell(row=row, column=2, value=mb)
-                    ws.cell(row=row, column=3, value=opp)
-                    ws.cell(row=row, column=4, value=br)
-                    ws.cell(row=row, column=5, value=set_to)
-                    cell_count = ws.cell(row=row, column=6, value=float(count))
-                    cell_count.number_format = "General"
-                    row += 1
-                row += 1
-
-        ws.cell(row=row, column=1, value='Reception R-')
-        row += 1
-        out_system = rec_tallies['R-']
-        if out_system:
-            ws.cell(row=row, column=1, value='Position')
-            ws.cell(row=row, column=2, value='Count')
-            row += 1
-            for pos, count in sorted(out_system.items(), key=lambda x: x[0]):
-                ws.cell(row=row, column=1, value=pos)
-                cell_count = ws.cell(row=row, column=2, value=float(count))
-                cell_count.number_format = "General"
-                row += 1
-            row += 1
-
-        ws.cell(row=row, column=1, value='Transition In-System')
-        row += 1
-        if trans_in_system:
-            ws.cell(row=row, column=1, value='OH')
-            ws.cell(row=row, column=2, value='MB')
-            ws.cell(row=row, column=3, value='OPP/S')
-            ws.cell(row=row, column=4, value='BR')
-            ws.cell(row=row, column=5, value='Set To')
-            ws.cell(row=row, column=6, value='Count')
-            row += 1
-            for (oh, mb, opp, br, set_to), count in sorted(trans_in_system.items(), key=lambda x: x[0]):
-                ws.cell(row=row, column=1, value=oh)
-                ws.cell(row=row, column=2, value=mb)
-                ws.cell(row=row, column=3, value=opp)
-                ws.cell(row=row, column=4, value=br)
-                ws.cell(row=row, column=5, value=set_to)
-                cell_count = ws.cell(row=row, column=6, value=float(count))
-                cell_count.number_format = "General"
-                row += 1
-            row += 1
-
-        ws.cell(row=row, column=1, value='Transition OOS TR')
-        row += 1
-        if trans_out_system:
-            ws.cell(row=row, column=1, value='Position')
-            ws.cell(row=row, column=2, value='Count')
-            row += 1
-            for pos, count in sorted(trans_out_system.items(), key=lambda x: x[0]):
-                ws.cell(row=row, column=1, value=pos)
-                cell_count = ws.cell(row=row, column=2, value=float(count))
-                cell_count.number_format = "General"
-                row += 1
-
-        formatted_row = 1
-        pattern_based = ['Reception R#', 'Reception R# or R+', 'Reception R!', 'Transition In-System']
-        position_based = ['Reception R-', 'Transition OOS TR']
-        category_key_map = {
-            'Reception R#': 'R#', 'Reception R# or R+': 'R# or R+', 'Reception R!': 'R!',
-            'Reception R-': 'R-', 'Transition In-System': 'Transition In-System', 'Transition OOS TR': 'Transition OOS TR'
+### Streamlit App
+@st.cache_resource
+def get_parsed_match_cache():
+    return ParsedMatchCache()
+
+@st.cache_resource
+def get_archive_cache():
+    # ingest_archive results keyed by (archive hash, home team)
+    return ParsedMatchCache(ARCHIVE_CACHE_SIZE)
+
+@st.cache_resource
+def get_ingest_pool():
+    # A single-core host gains nothing from worker processes
+    return make_ingest_pool() if (os.cpu_count() or 1) > 1 else None
+
+@st.cache_resource
+def get_season_store():
+    return SeasonStore()
+
+@st.cache_resource
+def get_report_cache():
+    return ReportCache()
+
+@st.cache_resource
+def get_report_jobs():
+    return ReportJobManager(get_report_cache())
+
+class StreamlitLogHandler(logging.Handler):
+    """Show warnings logged by the parsing and report code in the running app."""
+
+    def emit(self, record):
+        st.warning(self.format(record))
+
+@st.cache_resource
+def get_log_handler():
+    handler = StreamlitLogHandler(logging.WARNING)
+    logger.addHandler(handler)
+    return handler
+
+def main():
+    get_log_handler()
+    st.title("Volleyball Match Analysis")
+
+    # Get team from URL parameter if present
+    query_params = st.query_params
+    selected_team = query_params.get("team", TEAMS[0])  # Default to Stanford if no param
+
+    # Team Selection
+    team = st.selectbox("Select Team to Analyze", TEAMS, index=TEAMS.index(selected_team))
+    st.write(f"Analyzing files where **{team}** is the home team.")
+
+    profiler = PipelineProfiler(enabled=st.sidebar.checkbox("Profile pipeline stages"))
+    try:
+        analysis_page(team, profiler)
+    finally:
+        if profiler.enabled:
+            # Workbooks are built in background jobs; show the stages of this session's latest one
+            job = get_report_jobs().get(st.session_state.get('report_job'))
+            if job is not None:
+                profiler.records.extend(job.records)
+            show_profile(profiler)
+
+def show_profile(profiler):
+    with st.expander("Pipeline profile", expanded=True):
+        st.dataframe(profiler.to_frame(), hide_index=True)
+        st.download_button("Download profile (JSON)", profiler.to_json(), file_name="profile.json", mime="application/json")
+
+def analysis_page(team, profiler):
+    store = get_season_store()
+    source = st.radio("Match Source", ["Uploaded files", "Season store", "Live file"], horizontal=True)
+    if source == "Live file":
+        live_page(team)
+        return
+
+    if source == "Uploaded files":
+        # File Upload
+        uploaded_files = st.file_uploader(
+            f"Upload .dvw files or season .zip archives for {team}", type=["dvw", "zip"], accept_multiple_files=True,
+        )
+        if not uploaded_files:
+            st.info(f"Please upload .dvw files for {team} to begin analysis.")
+            return
+        dvw_files = [uploaded_file for uploaded_file in uploaded_files if not uploaded_file.name.lower().endswith('.zip')]
+        zip_files = [uploaded_file for uploaded_file in uploaded_files if uploaded_file.name.lower().endswith('.zip')]
+
+        # Parse new uploads (in parallel for large batches), add them to the season
+        # store and filter by home team
+        with profiler.stage('read uploads') as stage:
+            blobs = [uploaded_file.getvalue() for uploaded_file in dvw_files]
+            keys = [file_hash(data) for data in blobs]
+            stage['rows'] = len(blobs)
+        matches = ingest_matches(
+            blobs,
+            cache=get_parsed_match_cache(),
+            executor=get_ingest_pool(),
+            store=store,
+            names=[uploaded_file.name for uploaded_file in dvw_files],
+            profiler=profiler,
+            keys=keys,
+        )
+        ingested = {
+            uploaded_file.name: [(uploaded_file.name, key, match)]
+            for uploaded_file, key, match in zip(dvw_files, keys, matches)
         }
 
-        pattern_data = []
-        for cat in pattern_based:
-            key = category_key_map[cat]
-            tallies = trans_in_system if key == 'Transition In-System' else rec_tallies[key]
-            for (oh, mb, opp, br, set_to), count in tallies.items():
-                pattern_data.append({
-                    'Category': cat, 'OH': oh, 'MB': mb, 'OPP/S': opp, 'BR': br, 'Set To': set_to, 'Count': count
-                })
-        pattern_df = pd.DataFrame(pattern_data)
-
-        for cat in pattern_based:
-            ws[f'H{formatted_row}'] = cat
-            cat_df = pattern_df[pattern_df['Category'] == cat]
-            grouped = cat_df.groupby(['OH', 'MB', 'OPP/S', 'BR'])
-            for (oh, mb, opp, br), group in grouped:
-                states = [oh, mb, opp, br]
-                counter = {state: 0 for state in states}
-                for _, row_data in group.iterrows():
-                    set_to = row_data['Set To']
-                    if set_to in counter:
-                        counter[set_to] += row_data['Count']
-                total_count = sum(counter.values())
-                percentages = {state: (counter[state] / total_count) if total_count > 0 else 0.0 for state in states}
-                ws.cell(row=formatted_row+1, column=9, value=states[0])
-                ws.cell(row=formatted_row+1, column=10, value=states[1])
-                ws.cell(row=formatted_row+1, column=11, value=states[2])
-                ws.cell(row=formatted_row+1, column=12, value=states[3])
-                cell_total = ws.cell(row=formatted_row+2, column=8, value=float(total_count))
-                cell_total.number_format = "General"
-                for col, state in enumerate(states, start=9):
-                    cell_value = ws.cell(row=formatted_row+2, column=col, value=float(counter[state]))
-                    cell_value.number_format = "General"
-                for col, state in enumerate(states, start=9):
-                    ws.cell(row=formatted_row+3, column=col, value=f"{percentages[state]:.2f}")
-                formatted_row += 5
-
-        for cat in position_based:
-            ws[f'H{formatted_row}'] = cat
-            key = category_key_map[cat]
-            tallies = trans_out_system if key == 'Transition OOS TR' else rec_tallies[key]
-            positions = ['OH', 'MB', 'OPP/S', 'BR']
-            counter = {pos: tallies.get(pos, 0) for pos in positions}
-            total_count = sum(counter.values())
-            percentages = {pos: (counter[pos] / total_count) if total_count > 0 else 0.0 for pos in positions}
-            for col, pos in enumerate(positions, start=9):
-                ws.cell(row=formatted_row+1, column=col, value=pos)
-            cell_total = ws.cell(row=formatted_row+2, column=8, value=float(total_count))
-            cell_total.number_format = "General"
-            for col, pos in enumerate(positions, start=9):
-                cell_value = ws.cell(row=formatted_row+2, column=col, value=float(counter[pos]))
-                cell_value.number_format = "General"
-            for col, pos in enumerate(positions, start=9):
-                ws.cell(row=formatted_row+3, column=col, value=f"{percentages[pos]:.2f}")
-            formatted_row += 5
-
-    ws_set_odds = wb.create_sheet("Set Odds")
-    def calculate_set_odds(player_num, relevant_z_codes, rotation_labels, start_row):
-        ws_set_odds[f'A{start_row}'] = f"#{player_num} - Odds of Getting Set After a #{player_num} Reception"
-        ws_set_odds[f'B{start_row+1}'] = f"After #{player_num} Passed In System"
-        ws_set_odds[f'F{start_row+1}'] = f"After Someone Other #{player_num} Passed In System"
-        ws_set_odds[f'B{start_row+2}'] = f"#{player_num} Was Set"
-        ws_set_odds[f'C{start_row+2}'] = f"#{player_num} Not Set"
-        ws_set_odds[f'D{start_row+2}'] = f"#{player_num} Was Set %"
-        ws_set_odds[f'F{start_row+2}'] = f"#{player_num} Was Set"
-        ws_set_odds[f'G{start_row+2}'] = f"#{player_num} Not Set"
-        ws_set_odds[f'H{start_row+2}'] = f"#{player_num} Was Set %"
-
-        row = start_row + 3
-        total_was_set_passer = 0
-        total_not_set_passer = 0
-        total_was_set_other = 0
-        total_not_set_other = 0
-
-        for rot_name, z_code in zip(rotation_labels, relevant_z_codes):
-            ws_set_odds[f'A{row}'] = rot_name
-            filtered_df = df[(df['Reception Rotation'] == z_code) &
-                             (df['Pass Grade'].isin(['R#', 'R+', 'R!'])) &
-                             (df['Reception Custom Code'].notna())].copy()
-            filtered_df['parsed'] = filtered_df['Reception Custom Code'].apply(parse_in_system)
-            filtered_df = filtered_df[filtered_df['parsed'].notna()]
-
-            passer_df = filtered_df[filtered_df['Passer #'] == player_num]
-            was_set = (passer_df['parsed'].apply(lambda x: x['set_to'] == x['OH'])).sum()
-            not_set = len(passer_df) - was_set
-            total = was_set + not_set
-            percentage = was_set / total if total > 0 else 0
-            ws_set_odds[f'B{row}'] = was_set
-            ws_set_odds[f'C{row}'] = not_set
-            cell_d = ws_set_odds[f'D{row}']
-            cell_d.value = percentage
-            cell_d.number_format = '0.00'
-
-            other_df = filtered_df[filtered_df['Passer #'] != player_num]
-            was_set_other = (other_df['parsed'].apply(lambda x: x['set_to'] == x['OH'])).sum()
-            not_set_other = len(other_df) - was_set_other
-            total_other = was_set_other + not_set_other
-            percentage_other = was_set_other / total_other if total_other > 0 else 0
-            ws_set_odds[f'F{row}'] = was_set_other
-            ws_set_odds[f'G{row}'] = not_set_other
-            cell_h = ws_set_odds[f'H{row}']
-            cell_h.value = percentage_other
-            cell_h.number_format = '0.00'
-
-            total_was_set_passer += was_set
-            total_not_set_passer += not_set
-            total_was_set_other += was_set_other
-            total_not_set_other += not_set_other
-            row += 1
-
-        ws_set_odds[f'A{row}'] = "Tot"
-        total_passer = total_was_set_passer + total_not_set_passer
-        percentage_passer = total_was_set_passer / total_passer if total_passer > 0 else 0
-        ws_set_odds[f'B{row}'] = total_was_set_passer
-        ws_set_odds[f'C{row}'] = total_not_set_passer
-        cell_d_total = ws_set_odds[f'D{row}']
-        cell_d_total.value = percentage_passer
-        cell_d_total.number_format = '0.00'
-
-        total_other = total_was_set_other + total_not_set_other
-        percentage_other = total_was_set_other / total_other if total_other > 0 else 0
-        ws_set_odds[f'F{row}'] = total_was_set_other
-        ws_set_odds[f'G{row}'] = total_not_set_other
-        cell_h_total = ws_set_odds[f'H{row}']
-        cell_h_total.value = percentage_other
-        cell_h_total.number_format = '0.00'
-
-        return row + 2
-
-    oh1_rotations = [('*z1', 'Rot 1'), ('*z3', 'Rot 5'), ('*z2', 'Rot 6')]
-    oh1_z_codes, oh1_labels = zip(*oh1_rotations)
-    next_row = calculate_set_odds(oh1_num, oh1_z_codes, oh1_labels, 1)
-
-    oh2_rotations = [('*z6', 'Rot 2'), ('*z5', 'Rot 3'), ('*z4', 'Rot 4')]
-    oh2_z_codes, oh2_labels = zip(*oh2_rotations)
-    calculate_set_odds(oh2_num, oh2_z_codes, oh2_labels, next_row)
-
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output
-
-### Streamlit App
-st.title("Volleyball Match Analysis")
-
-# Get team from URL parameter if present
-query_params = st.query_params
-selected_team = query_params.get("team", TEAMS[0])  # Default to Stanford if no param
-
-# Team Selection
-team = st.selectbox("Select Team to Analyze", TEAMS, index=TEAMS.index(selected_team))
-st.write(f"Analyzing files where **{team}** is the home team.")
-
-# File Upload
-uploaded_files = st.file_uploader(f"Upload .dvw files for {team}", type="dvw", accept_multiple_files=True)
-
-if uploaded_files:
-    # Filter files by selected home team
-    file_contents = {}
-    valid_files = []
-    for uploaded_file in uploaded_files:
-        content = uploaded_file.read().decode('ISO-8859-1')
-        _, home_team, _ = parse_dvw_header(content)
-        if home_team == team:
-            file_contents[uploaded_file.name] = content
-            valid_files.append(uploaded_file.name)
-        else:
-            st.warning(f"File '{uploaded_file.name}' skipped: Home team '{home_team}' does not match selected team '{team}'.")
-
-    if not valid_files:
-        st.error(f"No uploaded files have '{team}' as the home team.")
+        # Archives are screened on header lines, so only this team's matches are read in full,
+        # and an archive already ingested for this team is not scanned again
+        archive_cache = get_archive_cache()
+        for zip_file in zip_files:
+            archive_key = (file_hash(zip_file.getvalue()), team)
+            ingested_archive = archive_cache.get(archive_key)
+            if ingested_archive is None:
+                try:
+                    ingested_archive = ingest_archive(
+                        zip_file, team, cache=get_parsed_match_cache(), executor=get_ingest_pool(), store=store,
+                        profiler=profiler,
+                    )
+                except zipfile.BadZipFile:
+                    st.error(f"File '{zip_file.name}' skipped: not a valid zip archive.")
+                    continue
+                archive_cache.put(archive_key, ingested_archive)
+            members, skipped = ingested_archive
+            ingested[zip_file.name] = [(f"{zip_file.name}/{member}", key, match) for member, key, match in members]
+            if skipped:
+                st.warning(f"{len(skipped)} files in '{zip_file.name}' skipped: Home team does not match selected team '{team}'.")
+
+        file_matches = {}
+        file_keys = {}
+        for uploaded_file in uploaded_files:
+            for name, key, match in ingested.get(uploaded_file.name, []):
+                if match['home_team'] == team:
+                    file_matches[name] = match
+                    file_keys[name] = key
+                else:
+                    st.warning(f"File '{name}' skipped: Home team '{match['home_team']}' does not match selected team '{team}'.")
+
+        if not file_matches:
+            st.error(f"No uploaded files have '{team}' as the home team.")
+            return
+        st.success(f"Found {len(file_matches)} valid files for {team}.")
+        match_keys = [file_keys[name] for name in file_matches]
+        stale_keys = set()
+        index = session_event_index(
+            match_keys, lambda: [(file_keys[name], match) for name, match in file_matches.items()], profiler,
+        )
+    else:
+        match_keys = store.match_keys(team)
+        if not match_keys:
+            st.info(f"The season store has no matches with {team} as the home team yet.")
+            return
+        st.success(f"Found {len(match_keys)} stored matches for {team}.")
+        # A stale match re-parsed since the index was built changes the key, so the index is rebuilt
+        stale_keys = store.stale_keys(team)
+        if stale_keys:
+            st.warning(f"{len(stale_keys)} stored matches were parsed under older reception/transition rules and "
+                       f"are shown as stored. Upload their files again to re-parse them.")
+        index = session_event_index(
+            [(key, key in stale_keys) for key in match_keys], lambda: store.load_matches(team), profiler,
+        )
+
+    # Extract opponents (away teams) from the team's matches
+    opponents = index.opponents()
+
+    # Opponent Selection
+    selected_opponents = st.multiselect("Select Opponents to Analyze", opponents, default=opponents)
+    if not selected_opponents:
+        st.warning("Please select at least one opponent to proceed.")
+        return
+
+    # Events from selected opponents only, looked up in the index
+    with profiler.stage('select events') as stage:
+        rec_df, trans_df, report_files = index.select(opponents=selected_opponents)
+        stage['rows'] = len(rec_df) + len(trans_df)
+    # Tallies and set odds are sums of per-match partials kept in the index
+    with profiler.stage('analyze tallies') as stage:
+        totals = index.tallies(opponents=selected_opponents)
+        rotation_tallies = totals.tallies
+        stage['rows'] = len(rec_df) + len(trans_df)
+    with profiler.stage('set odds matrix') as stage:
+        set_odds = totals.set_odds()
+        stage['rows'] = len(set_odds)
+
+    with st.expander("Tally Preview", expanded=True):
+        tally_preview(rotation_tallies)
+
+    # Set odds for every passer; OH1/OH2 below are views into the same matrix
+    with st.expander("Set Odds by Passer"):
+        metric = st.selectbox("Show", SET_ODDS_COLUMNS, key="set_odds_metric")
+        table = set_odds_table(set_odds, metric)
+        st.dataframe(table.round(2) if metric.endswith('%') else table)
+
+    # The same data as flat tables; written in one pass, without the workbook
+    with st.expander("Columnar Export"):
+        fmt = st.radio("Format", list(EXPORT_FORMATS), horizontal=True, key="export_format",
+                       format_func=lambda fmt: {'parquet': "Parquet", 'arrow': "Arrow IPC", 'csv': "CSV"}[fmt])
+        st.download_button(
+            label=f"Download tables ({fmt})",
+            data=lambda: export_archive(export_tables(rec_df, trans_df, rotation_tallies, set_odds), fmt),
+            file_name=f"{team} Analysis {fmt}.zip",
+            mime="application/zip",
+            on_click="ignore",
+        )
+
+    # User inputs for OH1 and OH2
+    oh1_num = st.text_input("Enter the number of OH1:", "")
+    oh2_num = st.text_input("Enter the number of OH2:", "")
+
+    if oh1_num and oh2_num:
+        jobs = get_report_jobs()
+        key = report_key(report_files, selected_opponents, oh1_num, oh2_num, team, stale_keys)
+
+        # The workbook is built in a background job, so the session stays usable and a
+        # rerun or changed input does not throw the build away
+        def build(job):
+            job_profiler = PipelineProfiler(enabled=profiler.enabled)
+            data = create_excel_in_memory(
+                rec_df, trans_df, oh1_num, oh2_num, team, job_profiler, set_odds, rotation_tallies, job.report,
+            ).getvalue()
+            job.records = job_profiler.records
+            return data
+
+        job = jobs.get(st.session_state.get('report_job'))
+        if job is not None and job.key != key:
+            job = None
+        data = jobs.cache.get(key)
+        if data is None and job is not None and job.status == 'done':
+            data = job.result
+
+        if data is not None:
+            st.download_button(
+                label="Download Analysis Excel",
+                data=data,
+                file_name=f"{team} Analysis.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                on_click="ignore",
+            )
+            st.success("Excel file generated successfully!")
+        elif job is None or job.done:
+            if job is not None and job.status == 'failed':
+                st.error(f"Generating the Excel file failed: {job.error}")
+            if st.button("Generate Excel File"):
+                job = jobs.submit(key, build)
+                st.session_state['report_job'] = job.id
+                if job.done:
+                    st.rerun()
+        if job is not None and not job.done:
+            st.fragment(report_job_progress, run_every=0.5)(job.id)
+
+def report_job_progress(job_id):
+    """Progress of a background report build, polled as a fragment; reruns the app once it finishes."""
+    jobs = get_report_jobs()
+    job = jobs.get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    if job.cancelled:
+        text = "Cancelling..."
+    elif job.status == 'queued':
+        text = "Waiting for a free report worker..."
+    elif job.sheet_name:
+        text = f"Writing {job.sheet_name} ({job.step + 1}/{job.steps})"
+    else:
+        text = "Saving workbook..." if job.step else "Preparing workbook..."
+    st.progress(job.progress, text=text)
+    if st.button("Cancel", key="cancel_report_job"):
+        jobs.cancel(job_id)
+        st.session_state['report_job'] = None
+        st.rerun()
+
+def session_event_index(match_keys, load_matches, profiler):
+    """This session's EventIndex over the matches match_keys identify, rebuilt only when they change."""
+    cached = st.session_state.get('event_index')
+    if cached is None or cached[0] != match_keys:
+        with profiler.stage('build index') as stage:
+            cached = (match_keys, EventIndex(load_matches()))
+            stage['rows'] = len(cached[1].receptions) + len(cached[1].transitions)
+        st.session_state['event_index'] = cached
+    return cached[1]
+
+def live_page(team):
+    path = st.text_input("Path of the .dvw being scouted", key="live_path")
+    if not path:
+        st.info("Enter the path of the scout file to follow the match live.")
+        return
+    if not Path(path).is_file():
+        st.error(f"No file at '{path}'.")
+        return
+    live = st.session_state.get('live_match')
+    if live is None or live.path != Path(path):
+        live = st.session_state['live_match'] = LiveMatch(path)
+    refresh = st.number_input("Refresh every (seconds)", min_value=1, max_value=60, value=5, key="live_refresh")
+    st.fragment(live_tallies, run_every=refresh)(live, team)
+
+def live_tallies(live, team):
+    """Take in what the scout has appended and redraw the tallies; runs as a fragment every refresh."""
+    live.poll()
+    if live.home_team != team:
+        st.warning(f"Home team '{live.home_team}' does not match selected team '{team}'.")
+    st.caption(f"{live.match_name}: {len(live.receptions)} receptions, {len(live.transitions)} transitions so far")
+    show_tallies(live.running.tallies)
+    with st.expander("Set Odds by Passer"):
+        metric = st.selectbox("Show", SET_ODDS_COLUMNS, key="live_set_odds_metric")
+        table = set_odds_table(live.running.set_odds(), metric)
+        st.dataframe(table.round(2) if metric.endswith('%') else table)
+
+@st.fragment
+def tally_preview(rotation_tallies):
+    """Tally and percentage blocks for one rotation sheet; picking a sheet or blocks reruns only this fragment."""
+    show_tallies(rotation_tallies)
+
+def show_tallies(rotation_tallies):
+    sheet = st.selectbox("Sheet", list(rotation_mapping.values()), key="preview_sheet")
+    blocks = st.multiselect("Blocks", SHEET_BLOCKS, default=SHEET_BLOCKS, key="preview_blocks")
+    z_code = next(z for z, name in rotation_mapping.items() if name == sheet)
+    tallies = sheet_blocks(*rotation_tallies[z_code])
+    for block in blocks:
+        st.markdown(f"**{block}**")
+        counts_column, shares_column = st.columns([2, 3])
+        counts_column.dataframe(tally_table(block, tallies[block]), hide_index=True)
+        shares_column.dataframe(share_table(block, tallies[block]).round(2), hide_index=True)
+
+if __name__ == "__main__":
+    if st.runtime.exists():
+        main()
     else:
-        st.success(f"Found {len(valid_files)} valid files for {team}.")
-
-        # Extract opponents (away teams) from valid files
-        opponents = set()
-        for content in file_contents.values():
-            _, _, away_team = parse_dvw_header(content)
-            opponents.add(away_team)
-        opponents = sorted(list(opponents))
-
-        # Opponent Selection
-        selected_opponents = st.multiselect("Select Opponents to Analyze", opponents, default=opponents)
-        if not selected_opponents:
-            st.warning("Please select at least one opponent to proceed.")
-        else:
-            # Process only selected opponents
-            filtered_file_contents = {
-                fname: content for fname, content in file_contents.items()
-                if parse_dvw_header(content)[2] in selected_opponents
-            }
-
-            # Extract data
-            all_receptions = []
-            all_transitions = []
-            for fname, content in filtered_file_contents.items():
-                match_date, _, away_team = parse_dvw_header(content)
-                match_name = f"{match_date} {away_team}"
-                receptions = extract_reception(content, match_name)
-                transitions = extract_transition(content, match_name)
-                all_receptions.extend(receptions)
-                all_transitions.extend(transitions)
-
-            # Create DataFrame
-            all_data = []
-            max_length = max(len(all_receptions), len(all_transitions))
-            for i in range(max_length):
-                rec_row = list(all_receptions[i]) if i < len(all_receptions) else ["", "", "", "", ""]
-                trans_row = list(all_transitions[i]) if i < len(all_transitions) else ["", "", "", ""]
-                row = rec_row + ["", ""] + trans_row
-                all_data.append(row)
-            df = pd.DataFrame(all_data, columns=[
-                "Reception Match Name", "Reception Rotation", "Passer #", "Pass Grade", "Reception Custom Code", "", "",
-                "Transition Match Name", "Transition Rotation", "Attacker #", "Transition Custom Code"
-            ])
-
-            # User inputs for OH1 and OH2
-            oh1_num = st.text_input("Enter the number of OH1:", "")
-            oh2_num = st.text_input("Enter the number of OH2:", "")
-
-            if oh1_num and oh2_num:
-                if st.button("Generate and Download Excel File"):
-                    with st.spinner("Generating Excel file..."):
-                        excel_file = create_excel_in_memory(df, oh1_num, oh2_num, team)
-                        st.download_button(
-                            label="Download Analysis Excel",
-                            data=excel_file,
-                            file_name=f"{team} Analysis.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
-                        st.success("Excel file generated successfully!")
-else:
-    st.info(f"Please upload .dvw files for {team} to begin analysis.")
\ No newline at end of file
+        sys.exit(cli())
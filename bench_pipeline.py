@@ -0,0 +1,160 @@
+"""Synthetic .dvw generator and benchmarks for the parse -> tally -> export pipeline.
+
+    python bench_pipeline.py                      # 1, 10, 50, 100 and 500 matches
+    python bench_pipeline.py --sizes 1 20 --rallies 200 --json bench.json
+
+Each stage is timed on its own and then re-run under tracemalloc for peak
+memory, so the timings are not skewed by allocation tracing.
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+import vs_core
+
+DEFAULT_SIZES = [1, 10, 50, 100, 500]
+
+# Code letters the custom-code decoder maps, per position
+OH_CODES = 'G4R5I2Y'
+MB_CODES = '31ABC2GRE'
+OPP_CODES = 'G4R5I2YAS'
+BR_CODES = '879WM0'
+OOS_CODES = '45789M'
+
+def _pattern_code(rng):
+    codes = [rng.choice(OH_CODES), rng.choice(MB_CODES), rng.choice(OPP_CODES), rng.choice(BR_CODES)]
+    return ''.join(codes) + rng.choice(codes)
+
+def _player(rng):
+    return f"{rng.randint(1, 20):02d}"
+
+def generate_dvw(seed, rallies=150, home_team="Stanford University", away_team="Opponent"):
+    """Return the text of a reproducible synthetic .dvw match.
+
+    Every rally has a rotation marker, a serve, a home reception and, for
+    most rallies, a dig or freeball followed by a set and a transition
+    attack, each carrying the ~ custom code the extractors look for.
+    """
+    rng = random.Random(seed)
+    lines = [
+        "[3DATAVOLLEYSCOUT]",
+        "FILEFORMAT: 2.0",
+        "[3MATCH]",
+        f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024;;2024-2025;;;;;;1252;1;Z;0;",
+        "[3TEAMS]",
+        f"HOME;{home_team};3;Head Coach;Assistant;;;",
+        f"AWAY;{away_team};1;Head Coach;Assistant;;;",
+        "[3MORE]",
+        ";;;;;;",
+        "[3SCOUT]",
+    ]
+    for _ in range(rallies):
+        lines.append(f"*z{rng.randint(1, 6)}>LUp;;;;;;;;")
+        lines.append(f"a{_player(rng)}SM+~~~;s;;;;;;")
+        grade = rng.choice('#+!-')
+        custom_code = rng.choice(OOS_CODES) if grade == '-' else _pattern_code(rng)
+        lines.append(f"*{_player(rng)}RM{grade}~~~~~{custom_code};r;;;;;")
+        lines.append(f"*{_player(rng)}EH#;;;")
+        lines.append(f"*{_player(rng)}AH+~~~;;;")
+        if rng.random() < 0.7:
+            lines.append(f"a{_player(rng)}AH+~~~;;;")
+            lines.append(f"*{_player(rng)}{rng.choice('DF')}H+~~~;;;")
+            lines.append(f"*{_player(rng)}EH#;;;")
+            custom_code = _pattern_code(rng) if rng.random() < 0.7 else rng.choice(OOS_CODES)
+            lines.append(f"*{_player(rng)}AH#~~~{custom_code};;;")
+        lines.append(rng.choice(["*p01:00;;", "ap00:01;;"]))
+    return '\n'.join(lines)
+
+def generate_season(matches, rallies=150, seed=0):
+    """Return a list of (file name, bytes) for a synthetic season against a rotating set of opponents."""
+    opponents = [f"Opponent {i}" for i in range(1, 9)]
+    return [
+        (f"match_{i:04d}.dvw",
+         generate_dvw(seed + i, rallies, away_team=opponents[i % len(opponents)]).encode('ISO-8859-1'))
+        for i in range(matches)
+    ]
+
+def write_season(directory, matches, rallies=150, seed=0):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, data in generate_season(matches, rallies, seed):
+        (directory / name).write_bytes(data)
+
+def _measure(func):
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+def bench_size(matches, rallies=150):
+    season = generate_season(matches, rallies)
+    contents = [(data.decode('ISO-8859-1'), f"match {i}") for i, (_, data) in enumerate(season)]
+    results = []
+
+    def stage(name, func):
+        result, seconds, peak = _measure(func)
+        results.append({'matches': matches, 'stage': name, 'seconds': seconds, 'peak_bytes': peak})
+        return result
+
+    events = stage('events_from_records', lambda: [
+        vs_core.events_from_records(vs_core.tokenize_dvw(content), name) for content, name in contents])
+    receptions = [row for match_receptions, _ in events for row in match_receptions]
+    transitions = [row for _, match_transitions in events for row in match_transitions]
+    parsed = stage('parse_match', lambda: [vs_core.parse_match(data) for _, data in season])
+    rec_df, trans_df = stage('build_event_tables', lambda: vs_core.build_event_tables(receptions, transitions))
+    stage('analyze_reception', lambda: [vs_core.analyze_reception(rec_df, z_code) for z_code in vs_core.rotation_mapping])
+    rotation_tallies = stage('tally_rotations', lambda: vs_core.tally_rotations(rec_df, trans_df))
+    stage('share_tables', lambda: vs_core.share_tables(rotation_tallies))
+    stage('set_odds_matrix', lambda: vs_core.set_odds_matrix(rec_df))
+    rec_groups = np.repeat(np.arange(matches), [len(match['receptions']) for match in parsed])
+    trans_groups = np.repeat(np.arange(matches), [len(match['transitions']) for match in parsed])
+    partials = stage('partial_tallies', lambda: vs_core.partial_tallies(rec_df, trans_df, rec_groups, trans_groups, matches))
+    stage('RunningTallies.merged', lambda: vs_core.RunningTallies.merged(partials).set_odds())
+    index = stage('EventIndex', lambda: vs_core.EventIndex(
+        [(vs_core.file_hash(data), match) for (_, data), match in zip(season, parsed)]))
+    stage('EventIndex.query', lambda: index.query(opponents="Opponent 1", last=5))
+    stage('create_excel_in_memory', lambda: vs_core.create_excel_in_memory(rec_df, trans_df, '5', '7', 'Stanford University'))
+    tables = vs_core.export_tables(rec_df, trans_df)
+    for fmt in vs_core.EXPORT_FORMATS:
+        stage(f'export_archive {fmt}', lambda: vs_core.export_archive(tables, fmt))
+    return results
+
+def format_results(results):
+    lines = [f"{'matches':>7}  {'stage':<24}{'seconds':>10}{'peak MiB':>10}"]
+    for row in results:
+        lines.append(f"{row['matches']:>7}  {row['stage']:<24}{row['seconds']:>10.3f}{row['peak_bytes'] / 2**20:>10.1f}")
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs='+', default=DEFAULT_SIZES, help="numbers of matches to benchmark")
+    parser.add_argument("--rallies", type=int, default=150, help="rallies per synthetic match")
+    parser.add_argument("--json", default=None, help="also write the results to this JSON file")
+    parser.add_argument("--write-season", default=None, metavar="DIR",
+                        help="only write a synthetic season of max(--sizes) matches to DIR")
+    args = parser.parse_args(argv)
+
+    if args.write_season:
+        write_season(args.write_season, max(args.sizes), args.rallies)
+        return 0
+
+    results = []
+    for matches in args.sizes:
+        size_results = bench_size(matches, args.rallies)
+        print(format_results(size_results), flush=True)
+        results.extend(size_results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,51 @@
+"""Reception and transition extraction under the rally/possession rules."""
+import pytest
+
+import vs_core
+
+SERVE = "*z2>LUp;;;\na05SM+~~~;;;\n"
+
+# (scout lines, expected receptions, expected transitions); every case is
+# extracted as a match named "m"
+CASES = {
+    "dig then attack, no set": (
+        SERVE + "*07RM#~~~~~G3G8G;;;\na11AH+~~~;;;\n*03DH+~~~;;;\n*09AH#~~~4;;;",
+        [("m", "*z2", 7, "R#", "G3G8G")], [("m", "*z2", 9, "4")],
+    ),
+    "dig, set, attack": (
+        SERVE + "*07RM-~~~~~5;;;\na11AH+~~~;;;\n*03FH+~~~;;;\n*12EH#;;;\n*09AH#~~~G3G8G;;;",
+        [("m", "*z2", 7, "R-", "5")], [("m", "*z2", 9, "G3G8G")],
+    ),
+    "only the first attack after a dig": (
+        SERVE + "*03DH+~~~;;;\n*12EH#;;;\n*09AH#~~~4;;;\n*10AH#~~~5;;;",
+        [], [("m", "*z2", 9, "4")],
+    ),
+    "block followed by a set": (
+        SERVE + "a11AH+~~~;;;\n*05BH+~~~;;;\n*12EH#;;;\n*09AH#~~~4;;;",
+        [], [],
+    ),
+    "set after the opponent touches": (
+        SERVE + "*03DH+~~~;;;\na11BH-~~~;;;\n*12EH#;;;\n*09AH#~~~4;;;",
+        [], [],
+    ),
+    "dig after the opponent touches": (
+        SERVE + "*03DH+~~~;;;\na11AH+~~~;;;\n*z3>LUp;;;\n*04DH+~~~;;;\n*12EH#;;;\n*09AH#~~~M;;;",
+        [], [("m", "*z3", 9, "M")],
+    ),
+    "rotation change mid-possession": (
+        "*z2>LUp;;;\n*03DH+~~~;;;\n*z3>LUp;;;\n*12EH#;;;\n*09AH#~~~M;;;",
+        [], [("m", "*z2", 9, "M")],
+    ),
+    "rotation change after a reception": (
+        SERVE + "*07RM#~~~~~G3G8G;;;\n*z3>LUp;;;\n*12EH#;;;\n*09AH#~~~G3G8G;;;",
+        [("m", "*z2", 7, "R#", "G3G8G")], [],
+    ),
+    "reception code without a grade": (
+        "*z1>LUp;;;\n*10RM;;;\n",
+        [], [],
+    ),
+}
+
+@pytest.mark.parametrize("content, receptions, transitions", CASES.values(), ids=CASES.keys())
+def test_events_from_records(content, receptions, transitions):
+    assert vs_core.events_from_records(vs_core.tokenize_dvw(content), "m") == (receptions, transitions)
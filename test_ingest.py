@@ -0,0 +1,25 @@
+"""Parsing uploads through the shared process pool."""
+import sys
+import types
+
+import bench_pipeline
+import vs_core
+
+def _season():
+    return [data for _, data in bench_pipeline.generate_season(vs_core.PARALLEL_PARSE_MIN_FILES, rallies=20)]
+
+def _comparable(matches):
+    return [{**match, 'tallies': match['tallies'].to_json()} for match in matches]
+
+def test_pool_parses_after_the_app_reruns(monkeypatch):
+    # Streamlit runs every rerun of the app script as a new __main__ module
+    monkeypatch.setitem(sys.modules, '__main__', types.ModuleType('__main__'))
+    blobs = _season()
+    with vs_core.make_ingest_pool(2) as executor:
+        assert _comparable(vs_core.ingest_matches(blobs, executor=executor)) == _comparable(map(vs_core.parse_match, blobs))
+
+def test_unusable_pool_falls_back_to_serial():
+    blobs = _season()
+    executor = vs_core.make_ingest_pool(2)
+    executor.shutdown()
+    assert _comparable(vs_core.ingest_matches(blobs, executor=executor)) == _comparable(map(vs_core.parse_match, blobs))
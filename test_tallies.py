@@ -0,0 +1,38 @@
+"""Per-match partial tallies: summed, stored and read back."""
+import sqlite3
+
+import pandas as pd
+
+import bench_pipeline
+import vs_core
+
+def _parsed(matches=6):
+    return [(vs_core.file_hash(data), vs_core.parse_match(data))
+            for _, data in bench_pipeline.generate_season(matches, rallies=60)]
+
+def test_summed_partials_match_a_recount():
+    parsed = _parsed()
+    rec_df, trans_df = vs_core.build_event_tables(
+        [row for _, match in parsed for row in match['receptions']],
+        [row for _, match in parsed for row in match['transitions']],
+    )
+    total = vs_core.RunningTallies.merged(match['tallies'] for _, match in parsed)
+    assert total.tallies == vs_core.tally_rotations(rec_df, trans_df)
+    pd.testing.assert_frame_equal(total.set_odds(), vs_core.set_odds_matrix(rec_df))
+
+def test_store_keeps_tallies(tmp_path):
+    store = vs_core.SeasonStore(tmp_path / "season.sqlite3")
+    for key, match in _parsed(2):
+        store.put(key, match)
+        assert store.get(key)['tallies'].to_json() == match['tallies'].to_json()
+
+def test_store_counts_tallies_missing_from_older_rows(tmp_path):
+    path = tmp_path / "season.sqlite3"
+    store = vs_core.SeasonStore(path)
+    [(key, match)] = _parsed(1)
+    store.put(key, match)
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE matches SET tallies = NULL")
+    assert store.get(key)['tallies'].to_json() == match['tallies'].to_json()
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT tallies FROM matches").fetchone()[0] == match['tallies'].to_json()
@@ -0,0 +1,1910 @@
+"""Parsing, season store, tallies and report building behind the Web30 app, plus the headless batch CLI.
+
+Kept out of the Streamlit script so that worker processes and other tools
+import it under one stable module name.
+"""
+import pandas as pd
+import numpy as np
+import re
+import hashlib
+import os
+import threading
+import multiprocessing
+import heapq
+import sqlite3
+import logging
+import argparse
+import json
+import time
+import tracemalloc
+import zipfile
+import uuid
+import pickle
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from collections import Counter, OrderedDict, namedtuple
+from itertools import groupby
+from operator import itemgetter
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from io import BytesIO, TextIOWrapper
+
+# Mapping dictionaries (unchanged)
+OH_map = {'G': 'Go', '4': '4 OOS', 'R': 'Red', '5': '5 OOS', 'I': 'Rip', '2': '2', 'Y': 'Boy'}
+MB_map = {'3': '3', '1': '1/Fix', 'A': 'A', 'B': 'Push A', 'C': 'C/Slide', '2': '2', 'G': 'Go', 'R': 'Red', 'E': 'None'}
+OPP_map = {'G': 'Go', '4': '4 OOS', 'R': 'Red', '5': '5 OOS', 'I': 'Rip', '2': '2', 'Y': 'Boy', 'A': 'A', 'S': 'Dump'}
+BR_map = {'8': 'Bic/Pipe', '7': 'Gap', '9': 'Sky/D', 'W': 'A', 'M': 'MB', '0': 'None'}
+rotation_mapping = {
+    '*z1': 'Rotation 1', '*z6': 'Rotation 2', '*z5': 'Rotation 3',
+    '*z4': 'Rotation 4', '*z3': 'Rotation 5', '*z2': 'Rotation 6'
+}
+
+# Parsers and the report builder log here instead of calling Streamlit directly,
+# so they run headless; the app forwards warnings to st.warning
+logger = logging.getLogger("vs_analysis")
+
+# Number of parsed matches kept in the shared cache (least recently used evicted first)
+PARSED_MATCH_CACHE_SIZE = 512
+
+# Batches with fewer uncached files than this are parsed serially, since
+# starting worker processes would cost more than it saves
+PARALLEL_PARSE_MIN_FILES = 8
+
+# Archive members are read and parsed this many at a time, which bounds how
+# much raw file data an upload holds at once
+ARCHIVE_CHUNK_FILES = 32
+
+# Number of ingested season archives kept in the shared cache, so a rerun
+# with the same upload does not scan and hash its members again
+ARCHIVE_CACHE_SIZE = 16
+
+# On-disk season store of parsed matches (SQLite)
+SEASON_STORE_PATH = os.environ.get('VS_SEASON_STORE', 'season_store.sqlite3')
+
+# Version of the reception/transition rules. Stored matches extracted under
+# an older one are parsed again the next time their file is uploaded.
+EVENTS_VERSION = 2
+
+# Total size of generated workbooks kept in memory for repeat downloads
+REPORT_CACHE_BYTES = int(os.environ.get('VS_REPORT_CACHE_BYTES', 256 * 2**20))
+
+# Workbooks built at once in the background, shared by every session
+REPORT_JOB_WORKERS = int(os.environ.get('VS_REPORT_JOB_WORKERS', 2))
+
+# Compiled scout-code patterns used by the tokenizer: the home rotation
+# marker and a ball contact (team, player, skill) up to the first ';'
+Z_CODE_RE = re.compile(r'\*z\d+')
+TOUCH_RE = re.compile(r'([*a])(\d{2})([SREABDF])[^;]*')
+
+# One typed record from tokenize_dvw. kind is 'header', 'teams', 'rotation'
+# or 'touch'; line_no is the 0-based line it came from.
+DvwRecord = namedtuple('DvwRecord', ['kind', 'line_no', 'value'])
+
+# The value of a 'touch' record. team is '*' (home) or 'a' (away), skill one
+# of S(erve), R(eception), E (set), A(ttack), B(lock), D(ig) or F(reeball),
+# and code the scout code up to its first ';'.
+Touch = namedtuple('Touch', ['line_no', 'team', 'player', 'skill', 'code'])
+
+# Consecutive touches by one team, numbered in file order. z_code is the home
+# rotation in effect at the first touch.
+Possession = namedtuple('Possession', ['number', 'rally', 'team', 'z_code', 'touches'])
+
+# Helper Functions (unchanged except where noted)
+def _iter_lines(source):
+    if isinstance(source, str):
+        return iter(source.split('\n'))
+    return (line.rstrip('\n') for line in source)
+
+class DvwTokenizer:
+    """The resumable state behind tokenize_dvw.
+
+    Feed it a file's lines in order, across as many reads as needed, and it
+    returns the DvwRecords each line produces. done turns True once a
+    header_only tokenizer has the match date and both teams.
+    """
+
+    def __init__(self, header_only=False):
+        self.header_only = header_only
+        self.line_no = 0
+        self.done = False
+        self._expect_match_line = False
+        self._in_teams = False
+        self._have_date = False
+        self._home_team = None
+
+    def feed(self, line):
+        i = self.line_no
+        self.line_no += 1
+        records = []
+        if self._expect_match_line or self._in_teams or '[' in line:
+            self._feed_header(line.strip(), i, records)
+        if self.header_only:
+            return records
+        if touch := TOUCH_RE.match(line):
+            team, player, skill = touch.groups()
+            records.append(DvwRecord('touch', i, Touch(i, team, int(player), skill, touch.group(0))))
+        elif z_match := Z_CODE_RE.match(line):
+            records.append(DvwRecord('rotation', i, z_match.group(0)))
+        return records
+
+    def _feed_header(self, stripped, i, records):
+        if self._expect_match_line:
+            self._expect_match_line = False
+            if stripped:
+                self._have_date = True
+                records.append(DvwRecord('header', i, stripped.split(';')[0]))
+        elif self._in_teams and stripped and not stripped.startswith(';'):
+            teams = stripped.split(';')
+            if len(teams) >= 3:
+                if self._home_team is None:
+                    self._home_team = teams[1].strip()
+                else:
+                    self._in_teams = False
+                    records.append(DvwRecord('teams', i, (self._home_team, teams[1].strip())))
+                    if self.header_only and self._have_date:
+                        self.done = True
+                        return
+        if stripped.startswith('[3MATCH]'):
+            self._expect_match_line = True
+        elif stripped.startswith('[3TEAMS]') and self._home_team is None:
+            self._in_teams = True
+
+    def finish(self):
+        """Records owed at end of file: a home team whose away line never came."""
+        if self._home_team is not None and self._in_teams:
+            return [DvwRecord('teams', None, (self._home_team, "Unknown Away"))]
+        return []
+
+def tokenize_dvw(source, header_only=False):
+    """Read a .dvw once and yield DvwRecords in file order.
+
+    source is the decoded file content or any iterable of lines. With
+    header_only=True the scan stops as soon as the match date and both teams
+    are known, so only the header lines are read.
+    """
+    tokenizer = DvwTokenizer(header_only)
+    for line in _iter_lines(source):
+        yield from tokenizer.feed(line)
+        if tokenizer.done:
+            return
+    yield from tokenizer.finish()
+
+def header_from_records(records):
+    match_date = "01.01"
+    home_team = "Unknown Home"
+    away_team = "Unknown Away"
+    for record in records:
+        if record.kind == 'header':
+            try:
+                day, month, _ = record.value.split('/')
+                match_date = f"{month}.{day}"
+            except ValueError:
+                logger.warning(f"Invalid date format: {record.value}")
+        elif record.kind == 'teams':
+            home_team, away_team = record.value
+    return match_date, home_team, away_team
+
+def parse_match_day(date_part):
+    """ISO date (yyyy-mm-dd) of a [3MATCH] date like 24/10/2024, or None if it is not one."""
+    try:
+        return datetime.strptime(date_part, '%d/%m/%Y').date().isoformat()
+    except ValueError:
+        return None
+
+def extract_custom_code(line):
+    pre_semicolon = line.split(';')[0]
+    parts = pre_semicolon.split('~')
+    return parts[-1] if parts else ""
+
+class RallyIndex:
+    """Scout touches grouped into rallies and possessions, built in one pass.
+
+    A serve starts a rally. A possession starts with a serve, reception,
+    dig, freeball or block, or when the other team touches the ball; every
+    touch keeps its line number.
+    """
+
+    def __init__(self):
+        self.z_code = None
+        self.rallies = 0
+        self.possessions = []
+        self._current = None
+        self._last_skill = None
+
+    def add(self, record):
+        """Take one record; returns the possession a touch went into, else None."""
+        if record.kind == 'rotation':
+            self.z_code = record.value
+            return None
+        if record.kind != 'touch':
+            return None
+        touch = record.value
+        skill = touch.skill
+        if skill == 'S':
+            self.rallies += 1
+        current = self._current
+        if current is None or current.team != touch.team or skill in 'SRDFB' or self._last_skill == 'B':
+            current = self._current = Possession(len(self.possessions), self.rallies, touch.team, self.z_code, [touch])
+            self.possessions.append(current)
+        else:
+            current.touches.append(touch)
+        self._last_skill = skill
+        return current
+
+class EventExtractor:
+    """Turns DvwRecords into reception and transition rows, one record at a time.
+
+    Rows are read off a RallyIndex as its possessions grow: a reception is
+    the home touch that opens a possession with R, a transition the first
+    home attack in a possession opened by a dig or freeball, whatever lies
+    between them. The index persists between calls, so a file can be
+    extracted in as many pieces as it is read in.
+    """
+
+    def __init__(self, match_name):
+        self.match_name = match_name
+        self.rallies = RallyIndex()
+
+    def add(self, record):
+        """Return ('reception', row), ('transition', row) or None for one record."""
+        possession = self.rallies.add(record)
+        if possession is None or possession.team != '*':
+            return None
+        touch = possession.touches[-1]
+        if touch.skill not in 'RA':
+            return None
+        first = possession.touches[0]
+        if touch is first and touch.skill == 'R' and possession.z_code:
+            if len(touch.code) < 6:
+                # No grade character, e.g. "*10RM;"
+                return None
+            pass_grade = touch.code[3] + touch.code[5]
+            custom_code = extract_custom_code(touch.code)
+            if pass_grade == 'R-' and len(custom_code) == 1 and custom_code in '45789M':
+                return 'reception', (self.match_name, possession.z_code, touch.player, pass_grade, custom_code)
+            elif pass_grade in ['R#', 'R+', 'R!'] and len(custom_code) == 5 and custom_code.isalnum():
+                return 'reception', (self.match_name, possession.z_code, touch.player, pass_grade, custom_code)
+        elif (touch.skill == 'A' and first.skill in 'DF'
+                and not any(t.skill == 'A' for t in possession.touches[1:-1])):
+            # The rotation is the one in effect on the dig/freeball
+            custom_code = extract_custom_code(touch.code)
+            if len(custom_code) == 5 and custom_code.isalnum():
+                return 'transition', (self.match_name, possession.z_code, touch.player, custom_code)
+            elif len(custom_code) == 1 and custom_code in '45789M':
+                return 'transition', (self.match_name, possession.z_code, touch.player, custom_code)
+        return None
+
+def events_from_records(records, match_name):
+    """Return (receptions, transitions) from one pass over a match's records."""
+    extractor = EventExtractor(match_name)
+    events = {'reception': [], 'transition': []}
+    for record in records:
+        event = extractor.add(record)
+        if event is not None:
+            events[event[0]].append(event[1])
+    return events['reception'], events['transition']
+
+class PipelineProfiler:
+    """Opt-in wall time, row count and peak allocation per pipeline stage.
+
+    Wrap each stage in `with profiler.stage(name, file) as stage:` and set
+    stage['rows'] inside the block. tracemalloc has one peak per process, so
+    a stage that overlaps another one (nested, or on another thread such as
+    a background report job) keeps its time and rows but records no peak.
+    A disabled profiler records nothing and costs next to nothing, so
+    callers can pass one unconditionally.
+    """
+
+    # Shared by every profiler: how many stages are running, how many have
+    # started, and whether tracing was started here and is stopped here
+    _tracing_lock = threading.Lock()
+    _active_stages = 0
+    _stages_started = 0
+    _owns_tracing = False
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, file=None):
+        record = {'stage': name, 'file': file, 'rows': None, 'seconds': None, 'peak_bytes': None}
+        if not self.enabled:
+            yield record
+            return
+        cls = PipelineProfiler
+        with cls._tracing_lock:
+            if cls._active_stages == 0:
+                cls._owns_tracing = not tracemalloc.is_tracing()
+                if cls._owns_tracing:
+                    tracemalloc.start()
+            cls._active_stages += 1
+            cls._stages_started += 1
+            ticket = cls._stages_started
+            alone = cls._active_stages == 1
+            if alone:
+                tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            with cls._tracing_lock:
+                # Any stage started since this one overlapped it and moved the shared peak
+                if alone and cls._stages_started == ticket:
+                    record['peak_bytes'] = tracemalloc.get_traced_memory()[1] - baseline
+                cls._active_stages -= 1
+                if cls._active_stages == 0 and cls._owns_tracing:
+                    tracemalloc.stop()
+            self.records.append(record)
+
+    def to_frame(self):
+        return pd.DataFrame(self.records, columns=['stage', 'file', 'rows', 'seconds', 'peak_bytes'])
+
+    def to_json(self):
+        return json.dumps(self.records, indent=2)
+
+NULL_PROFILER = PipelineProfiler(enabled=False)
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def parse_match(data, profiler=NULL_PROFILER, file_name=None):
+    """Decode one uploaded .dvw and return its header fields, events and their RunningTallies."""
+    with profiler.stage('decode', file_name) as stage:
+        content = data.decode('ISO-8859-1')
+        stage['rows'] = content.count('\n') + 1
+    with profiler.stage('tokenize', file_name) as stage:
+        records = list(tokenize_dvw(content))
+        stage['rows'] = len(records)
+    with profiler.stage('header_from_records', file_name):
+        match_date, home_team, away_team = header_from_records(records)
+        match_day = next((parse_match_day(record.value) for record in records if record.kind == 'header'), None)
+    match_name = f"{match_date} {away_team}"
+    with profiler.stage('extract events', file_name) as stage:
+        receptions, transitions = events_from_records(records, match_name)
+        stage['rows'] = len(receptions) + len(transitions)
+    with profiler.stage('partial tallies', file_name) as stage:
+        tallies = RunningTallies.from_events(receptions, transitions)
+        stage['rows'] = len(receptions) + len(transitions)
+    return {
+        'match_date': match_date,
+        'home_team': home_team,
+        'away_team': away_team,
+        'match_name': match_name,
+        'match_day': match_day,
+        'receptions': receptions,
+        'transitions': transitions,
+        'tallies': tallies,
+    }
+
+class ParsedMatchCache:
+    """Thread-safe LRU of parse_match results keyed by the hash of the file bytes.
+
+    One instance is shared by every session on the server, so cached results
+    must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=PARSED_MATCH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, match):
+        with self._lock:
+            self._entries[key] = match
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+def make_ingest_pool(max_workers=None):
+    # spawn rather than fork: the Streamlit server is multi-threaded. Workers
+    # import parse_match from this module, never from the app script, which
+    # Streamlit re-executes as a new __main__ on every rerun
+    return ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count(),
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+
+def ingest_matches(blobs, cache=None, executor=None, store=None, names=None, profiler=NULL_PROFILER, keys=None):
+    """Parse a list of .dvw file bytes and return parse_match results in the same order.
+
+    Files found in cache or in the season store are not parsed again. The
+    remaining files are fanned out over executor when there are at least
+    PARALLEL_PARSE_MIN_FILES of them, otherwise parsed serially, and are then
+    added to the store under their file name from names. An enabled profiler
+    forces serial parsing so the per-file stages can be measured, and files
+    the pool fails to parse (a broken or shut down pool) are parsed serially
+    instead. keys are the file_hash of each blob, if the caller already has
+    them.
+    """
+    if keys is None:
+        keys = [file_hash(data) for data in blobs]
+    names = dict(zip(keys, names)) if names is not None else {}
+    matches = {}
+    pending = {}
+    for key, data in zip(keys, blobs):
+        if key in matches or key in pending:
+            continue
+        match = cache.get(key) if cache is not None else None
+        if match is None and store is not None:
+            match = store.get(key)
+            if match is not None and cache is not None:
+                cache.put(key, match)
+        if match is None:
+            pending[key] = data
+        else:
+            matches[key] = match
+    if pending:
+        if profiler.enabled:
+            parsed = [parse_match(data, profiler, names.get(key)) for key, data in pending.items()]
+        elif executor is not None and len(pending) >= PARALLEL_PARSE_MIN_FILES:
+            chunksize = max(1, len(pending) // (4 * (os.cpu_count() or 1)))
+            try:
+                parsed = list(executor.map(parse_match, pending.values(), chunksize=chunksize))
+            except (BrokenProcessPool, pickle.PicklingError, RuntimeError) as exc:
+                logger.info(f"Parsing {len(pending)} files serially: the ingest pool failed ({exc!r})")
+                parsed = map(parse_match, pending.values())
+        else:
+            parsed = map(parse_match, pending.values())
+        # executor.map yields in submission order, so the merge is deterministic
+        for key, match in zip(pending, parsed):
+            matches[key] = match
+            if cache is not None:
+                cache.put(key, match)
+            if store is not None:
+                store.put(key, match, file_name=names.get(key))
+    return [matches[key] for key in keys]
+
+def archive_members(archive):
+    """Names of the .dvw files inside a zip archive, in archive order."""
+    return [
+        info.filename for info in archive.infolist()
+        if not info.is_dir() and info.filename.lower().endswith('.dvw')
+        and not Path(info.filename).name.startswith('._')
+    ]
+
+def read_member_teams(archive, member):
+    """(home, away) from a zipped .dvw, decoding only the header lines.
+
+    Returns None when the member has no team lines.
+    """
+    with archive.open(member) as raw:
+        lines = TextIOWrapper(raw, encoding='ISO-8859-1')
+        return next((record.value for record in tokenize_dvw(lines, header_only=True) if record.kind == 'teams'), None)
+
+def ingest_archive(fileobj, home_team, cache=None, executor=None, store=None, profiler=NULL_PROFILER,
+                   chunk_files=ARCHIVE_CHUNK_FILES):
+    """Ingest the .dvw files in a zip whose home team is home_team.
+
+    Members are screened on their header lines alone; only the matching ones
+    are read in full, chunk_files at a time, through ingest_matches, so the
+    raw and decoded text of a chunk is dropped once its events are extracted.
+    Returns ([(member, file hash, match)], [skipped members]).
+    """
+    with zipfile.ZipFile(fileobj) as archive:
+        with profiler.stage('scan archive') as stage:
+            members = archive_members(archive)
+            selected = []
+            skipped = []
+            for member in members:
+                teams = read_member_teams(archive, member)
+                (selected if teams is not None and teams[0] == home_team else skipped).append(member)
+            stage['rows'] = len(members)
+        results = []
+        for start in range(0, len(selected), chunk_files):
+            chunk = selected[start:start + chunk_files]
+            with profiler.stage('read archive') as stage:
+                blobs = [archive.read(member) for member in chunk]
+                keys = [file_hash(data) for data in blobs]
+                stage['rows'] = len(blobs)
+            matches = ingest_matches(
+                blobs, cache=cache, executor=executor, store=store, names=chunk, profiler=profiler, keys=keys,
+            )
+            results.extend(zip(chunk, keys, matches))
+    return results, skipped
+
+RECEPTION_COLUMNS = ['Match Name', 'Rotation', 'Passer #', 'Pass Grade', 'Custom Code']
+TRANSITION_COLUMNS = ['Match Name', 'Rotation', 'Attacker #', 'Custom Code']
+
+def _event_table(rows, columns, player_column):
+    table = pd.DataFrame(rows, columns=columns, dtype=object)
+    players = table[player_column].tolist()
+    label_column = player_column.replace('#', 'Label')
+    table[label_column] = pd.array([None if isinstance(p, int) else str(p) for p in players], dtype='string')
+    table[player_column] = pd.array([p if isinstance(p, int) else None for p in players], dtype='UInt8')
+    for column in columns:
+        if column != player_column:
+            table[column] = table[column].astype('category')
+    return table
+
+def build_event_tables(receptions, transitions):
+    """Build the typed reception and transition tables from extracted rows.
+
+    Match name, rotation, pass grade and custom code are categoricals (custom
+    codes come from a small fixed set). Jersey numbers are nullable UInt8 in
+    'Passer #'/'Attacker #', with any non-numeric player text kept in
+    'Passer Label'/'Attacker Label' instead.
+    """
+    return (
+        _event_table(receptions, RECEPTION_COLUMNS, 'Passer #'),
+        _event_table(transitions, TRANSITION_COLUMNS, 'Attacker #'),
+    )
+
+def player_keys(table, player_column):
+    """Player numbers as text ("5"), falling back to the label for non-numeric players."""
+    label_column = player_column.replace('#', 'Label')
+    return table[player_column].astype('string').fillna(table[label_column])
+
+class SeasonStore:
+    """SQLite store of parsed matches and their events, keyed by file hash.
+
+    Rows are exactly what events_from_records produces, plus the match
+    metadata from header_from_records and the match's RunningTallies as
+    JSON, so a season only has to be parsed and counted once. Every call
+    opens its own connection, which keeps one instance safe to share
+    between Streamlit sessions.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS matches (
+            file_hash TEXT PRIMARY KEY, file_name TEXT, match_date TEXT,
+            home_team TEXT, away_team TEXT, match_name TEXT, match_day TEXT,
+            events_version INTEGER, tallies TEXT
+        );
+        CREATE INDEX IF NOT EXISTS matches_teams ON matches (home_team, away_team);
+        CREATE TABLE IF NOT EXISTS receptions (
+            file_hash TEXT, seq INTEGER, match_name TEXT, rotation TEXT,
+            passer, pass_grade TEXT, custom_code TEXT,
+            PRIMARY KEY (file_hash, seq)
+        );
+        CREATE TABLE IF NOT EXISTS transitions (
+            file_hash TEXT, seq INTEGER, match_name TEXT, rotation TEXT,
+            attacker, custom_code TEXT,
+            PRIMARY KEY (file_hash, seq)
+        );
+    """
+
+    def __init__(self, path=SEASON_STORE_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+            # Stores written before matches had a full date; their matches keep a NULL match_day
+            columns = {column for _, column, *_ in conn.execute("PRAGMA table_info(matches)")}
+            if 'match_day' not in columns:
+                conn.execute("ALTER TABLE matches ADD COLUMN match_day TEXT")
+            # and before events were versioned, which makes them version 1
+            if 'events_version' not in columns:
+                conn.execute("ALTER TABLE matches ADD COLUMN events_version INTEGER")
+            # and before they kept tallies, which are counted on first read
+            if 'tallies' not in columns:
+                conn.execute("ALTER TABLE matches ADD COLUMN tallies TEXT")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key, stale=False):
+        """Return the stored match in parse_match form, or None if key was never ingested.
+
+        A match whose events predate EVENTS_VERSION also counts as missing,
+        unless stale is True.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT match_date, home_team, away_team, match_name, match_day, tallies FROM matches "
+                "WHERE file_hash = ? AND IFNULL(events_version, 1) >= ?", (key, 1 if stale else EVENTS_VERSION)
+            ).fetchone()
+            if row is None:
+                return None
+            receptions = conn.execute(
+                "SELECT match_name, rotation, passer, pass_grade, custom_code FROM receptions "
+                "WHERE file_hash = ? ORDER BY seq", (key,)
+            ).fetchall()
+            transitions = conn.execute(
+                "SELECT match_name, rotation, attacker, custom_code FROM transitions "
+                "WHERE file_hash = ? ORDER BY seq", (key,)
+            ).fetchall()
+            match_date, home_team, away_team, match_name, match_day, tallies = row
+            if tallies is None:
+                tallies = RunningTallies.from_events(receptions, transitions)
+                conn.execute("UPDATE matches SET tallies = ? WHERE file_hash = ?", (tallies.to_json(), key))
+            else:
+                tallies = RunningTallies.from_json(tallies)
+        return {
+            'match_date': match_date,
+            'home_team': home_team,
+            'away_team': away_team,
+            'match_name': match_name,
+            'match_day': match_day,
+            'receptions': receptions,
+            'transitions': transitions,
+            'tallies': tallies,
+        }
+
+    def put(self, key, match, file_name=None):
+        tallies = match.get('tallies') or RunningTallies.from_events(match['receptions'], match['transitions'])
+        with self._connect() as conn:
+            # A stale match is replaced where it stands, so it keeps its place in ingest order
+            stale = conn.execute(
+                "UPDATE matches SET match_date = ?, home_team = ?, away_team = ?, match_name = ?, match_day = ?, "
+                "events_version = ?, tallies = ? WHERE file_hash = ? AND IFNULL(events_version, 1) < ?",
+                (match['match_date'], match['home_team'], match['away_team'], match['match_name'], match['match_day'],
+                 EVENTS_VERSION, tallies.to_json(), key, EVENTS_VERSION),
+            ).rowcount
+            if stale:
+                conn.execute("DELETE FROM receptions WHERE file_hash = ?", (key,))
+                conn.execute("DELETE FROM transitions WHERE file_hash = ?", (key,))
+            elif not conn.execute(
+                "INSERT OR IGNORE INTO matches VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, file_name, match['match_date'], match['home_team'], match['away_team'], match['match_name'],
+                 match['match_day'], EVENTS_VERSION, tallies.to_json()),
+            ).rowcount:
+                return
+            conn.executemany(
+                "INSERT INTO receptions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((key, seq) + tuple(row) for seq, row in enumerate(match['receptions'])),
+            )
+            conn.executemany(
+                "INSERT INTO transitions VALUES (?, ?, ?, ?, ?, ?)",
+                ((key, seq) + tuple(row) for seq, row in enumerate(match['transitions'])),
+            )
+
+    @staticmethod
+    def _team_filter(home_team, opponents):
+        where = "m.home_team = ?"
+        params = [home_team]
+        if opponents is not None:
+            where += f" AND m.away_team IN ({', '.join('?' * len(opponents))})"
+            params.extend(opponents)
+        return where, params
+
+    def match_keys(self, home_team, opponents=None):
+        """File hashes of home_team's matches against opponents, in ingest order."""
+        where, params = self._team_filter(home_team, opponents)
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT m.file_hash FROM matches m WHERE {where} ORDER BY m.rowid", params).fetchall()
+        return [key for key, in rows]
+
+    def stale_keys(self, home_team, opponents=None):
+        """The subset of match_keys whose events predate EVENTS_VERSION."""
+        where, params = self._team_filter(home_team, opponents)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT m.file_hash FROM matches m WHERE {where} AND IFNULL(m.events_version, 1) < ?",
+                params + [EVENTS_VERSION],
+            ).fetchall()
+        return {key for key, in rows}
+
+    def load_matches(self, home_team, opponents=None):
+        """Return [(file hash, match)] for home_team's matches against opponents, in ingest order.
+
+        Matches not yet re-parsed under EVENTS_VERSION are returned as stored.
+        """
+        return [(key, self.get(key, stale=True)) for key in self.match_keys(home_team, opponents)]
+
+def parse_in_system(pattern):
+    if len(pattern) != 5 or not pattern.isalnum():
+        return None
+    oh_code, mb_code, opp_code, br_code, set_code = pattern
+    oh = OH_map.get(oh_code, oh_code)
+    mb = MB_map.get(mb_code, mb_code)
+    opp = OPP_map.get(opp_code, opp_code)
+    br = BR_map.get(br_code, br_code)
+    if set_code == oh_code:
+        set_to = oh
+    elif set_code == mb_code:
+        set_to = mb
+    elif set_code == opp_code:
+        set_to = opp
+    elif set_code == br_code:
+        set_to = br
+    else:
+        return None
+    return {'OH': oh, 'MB': mb, 'OPP/S': opp, 'BR': br, 'set_to': set_to}
+
+def parse_out_of_system(code):
+    mapping = {'4': 'OH', '5': 'RS', 'M': 'MB', '7': 'BR', '8': 'BR', '9': 'BR'}
+    return mapping.get(code)
+
+PATTERN_COLUMNS = ['OH', 'MB', 'OPP/S', 'BR', 'set_to']
+
+def decode_custom_codes(codes):
+    """Decode a Series of custom codes into categorical pattern and position columns.
+
+    Each distinct code is decoded once. Columns are OH, MB, OPP/S, BR and
+    set_to for in-system patterns plus Position for out-of-system codes; a
+    row that is not a valid code of that kind is NaN in those columns.
+    """
+    codes = codes.astype('category')
+    table = []
+    for code in codes.cat.categories:
+        parsed = parse_in_system(code)
+        row = [parsed[col] for col in PATTERN_COLUMNS] if parsed else [None] * len(PATTERN_COLUMNS)
+        row.append(parse_out_of_system(code) if len(code) == 1 else None)
+        table.append(row)
+    table = pd.DataFrame(table, columns=PATTERN_COLUMNS + ['Position'], dtype=object)
+    decoded = table.reindex(codes.cat.codes.to_numpy())
+    decoded.index = codes.index
+    return decoded.astype('category')
+
+def tally_receptions(rec_df, rotations=None):
+    """Count reception patterns for every rotation with one grouped aggregation.
+
+    Returns {z_code: rec_tallies} in the shape analyze_reception returns.
+    """
+    rotations = list(rotation_mapping) if rotations is None else list(rotations)
+    results = {z_code: {'R#': Counter(), 'R# or R+': Counter(), 'R!': Counter(), 'R-': Counter()} for z_code in rotations}
+    rec_df = rec_df[rec_df['Rotation'].isin(rotations)]
+    rec = decode_custom_codes(rec_df['Custom Code'])
+    rec['Rotation'] = rec_df['Rotation']
+    rec['Pass Grade'] = rec_df['Pass Grade']
+    in_system = rec[rec['Pass Grade'].isin(['R#', 'R+', 'R!'])]
+    sizes = in_system.groupby(['Rotation', 'Pass Grade'] + PATTERN_COLUMNS, observed=True).size()
+    for (z_code, pass_grade, *pattern), count in sizes.items():
+        if pass_grade != 'R+':
+            results[z_code][pass_grade][tuple(pattern)] += int(count)
+        if pass_grade in ('R#', 'R+'):
+            results[z_code]['R# or R+'][tuple(pattern)] += int(count)
+    out_system = rec[rec['Pass Grade'] == 'R-'].groupby(['Rotation', 'Position'], observed=True).size()
+    for (z_code, pos), count in out_system.items():
+        results[z_code]['R-'][pos] += int(count)
+    return results
+
+def tally_transitions(trans_df, rotations=None):
+    """Count transition patterns and OOS positions for every rotation.
+
+    Returns {z_code: (in_system, out_system)} in the shape analyze_transition returns.
+    """
+    rotations = list(rotation_mapping) if rotations is None else list(rotations)
+    results = {z_code: (Counter(), Counter()) for z_code in rotations}
+    trans_df = trans_df[trans_df['Rotation'].isin(rotations)]
+    trans = decode_custom_codes(trans_df['Custom Code'])
+    trans['Rotation'] = trans_df['Rotation']
+    for (z_code, *pattern), count in trans.groupby(['Rotation'] + PATTERN_COLUMNS, observed=True).size().items():
+        results[z_code][0][tuple(pattern)] += int(count)
+    for (z_code, pos), count in trans.groupby(['Rotation', 'Position'], observed=True).size().items():
+        results[z_code][1][pos] += int(count)
+    return results
+
+def tally_rotations(rec_df, trans_df, rotations=None):
+    """Compute the reception and transition tallies for every rotation in one pass.
+
+    Returns {z_code: (rec_tallies, trans_in_system, trans_out_system)} in the
+    same shape analyze_reception and analyze_transition return.
+    """
+    rec_results = tally_receptions(rec_df, rotations)
+    trans_results = tally_transitions(trans_df, rotations)
+    return {z_code: (rec_results[z_code],) + trans_results[z_code] for z_code in rec_results}
+
+def analyze_reception(rec_df, rotation):
+    return tally_receptions(rec_df, [rotation])[rotation]
+
+def analyze_transition(trans_df, rotation):
+    return tally_transitions(trans_df, [rotation])[rotation]
+
+POSITIONS = ['OH', 'MB', 'OPP/S', 'BR']
+PATTERN_BLOCKS = ['Reception R#', 'Reception R# or R+', 'Reception R!', 'Transition In-System']
+POSITION_BLOCKS = ['Reception R-', 'Transition OOS TR']
+SHEET_BLOCKS = ['Reception R#', 'Reception R# or R+', 'Reception R!', 'Reception R-', 'Transition In-System', 'Transition OOS TR']
+
+def sheet_blocks(rec_tallies, trans_in_system, trans_out_system):
+    """Map each block title on a rotation sheet to its tallies."""
+    return {
+        'Reception R#': rec_tallies['R#'], 'Reception R# or R+': rec_tallies['R# or R+'],
+        'Reception R!': rec_tallies['R!'], 'Reception R-': rec_tallies['R-'],
+        'Transition In-System': trans_in_system, 'Transition OOS TR': trans_out_system,
+    }
+
+SET_COLUMNS = [f'{pos} Sets' for pos in POSITIONS]
+SHARE_COLUMNS = [f'{pos} %' for pos in POSITIONS]
+
+def tally_table(block, tallies):
+    """A block's tallies as the sheet lists them: one row per pattern or position."""
+    if block in POSITION_BLOCKS:
+        return pd.DataFrame(sorted(tallies.items()), columns=['Position', 'Count'])
+    rows = [key + (count,) for key, count in sorted(tallies.items())]
+    return pd.DataFrame(rows, columns=['OH', 'MB', 'OPP/S', 'BR', 'Set To', 'Count'])
+
+def _with_shares(table):
+    totals = table['Total'].to_numpy(dtype=float)
+    table[SHARE_COLUMNS] = table[SET_COLUMNS].to_numpy(dtype=float) / np.where(totals > 0, totals, 1.0)[:, None]
+    return table
+
+def _pattern_share_tables(block_tallies):
+    """share_table for many pattern blocks, {key: table}, pivoted in one grouped pass over {key: tallies}."""
+    sizes = [len(tallies) for tallies in block_tallies.values()]
+    patterns = pd.DataFrame([key for tallies in block_tallies.values() for key in tallies],
+                            columns=PATTERN_COLUMNS, dtype=object)
+    counts = np.fromiter((count for tallies in block_tallies.values() for count in tallies.values()),
+                         dtype=np.int64, count=sum(sizes))
+    to_slot = np.column_stack(
+        [(patterns['set_to'] == patterns[pos]).to_numpy(dtype=bool) for pos in POSITIONS]
+    ).reshape(len(counts), len(POSITIONS))
+    sets = pd.DataFrame(to_slot * counts[:, None], columns=SET_COLUMNS)
+    # Sets to a code outside the pattern are left out of the total
+    sets.insert(0, 'Total', np.where(to_slot.any(axis=1), counts, 0))
+    sets[POSITIONS] = patterns[POSITIONS]
+    sets['Block'] = np.repeat(np.arange(len(sizes)), sizes)
+    table = _with_shares(sets.groupby(['Block'] + POSITIONS, sort=True)[['Total'] + SET_COLUMNS].sum().reset_index())
+    rows = table.groupby('Block').indices
+    table = table.drop(columns='Block')
+    return {
+        key: table.iloc[rows.get(i, NO_ROWS)].reset_index(drop=True)
+        for i, key in enumerate(block_tallies)
+    }
+
+def share_table(block, tallies):
+    """A block's set distribution, as the formatted section of the sheet lays it out.
+
+    Pattern blocks get one row per (OH, MB, OPP/S, BR) pattern in sorted
+    order: the sets to each slot, their Total (a state in two slots counts
+    once) and each slot's share of it. Position blocks are a single row over
+    POSITIONS. Shares are fractions, 0.0 where nothing was set.
+    """
+    if block in PATTERN_BLOCKS:
+        return _pattern_share_tables({block: tallies})[block]
+    table = pd.DataFrame([[tallies.get(pos, 0) for pos in POSITIONS]], columns=SET_COLUMNS)
+    table.insert(0, 'Total', table.sum(axis=1))
+    return _with_shares(table)
+
+def share_tables(rotation_tallies):
+    """share_table for every block of every rotation, {z_code: {block: table}}.
+
+    All pattern blocks are pivoted together in one grouped pass.
+    """
+    by_block = {z_code: sheet_blocks(*tallies) for z_code, tallies in rotation_tallies.items()}
+    patterns = _pattern_share_tables(
+        {(z_code, block): blocks[block] for z_code, blocks in by_block.items() for block in PATTERN_BLOCKS}
+    )
+    return {
+        z_code: {
+            block: patterns[z_code, block] if block in PATTERN_BLOCKS else share_table(block, blocks[block])
+            for block in SHEET_BLOCKS
+        }
+        for z_code, blocks in by_block.items()
+    }
+
+SET_ODDS_COLUMNS = ['Was Set', 'Not Set', 'Was Set %', 'Others Was Set', 'Others Not Set', 'Others Was Set %']
+
+def _with_set_percentages(odds):
+    for prefix in ['', 'Others ']:
+        total = odds[f'{prefix}Was Set'] + odds[f'{prefix}Not Set']
+        odds[f'{prefix}Was Set %'] = (odds[f'{prefix}Was Set'] / total.where(total > 0)).fillna(0.0)
+    return odds[SET_ODDS_COLUMNS]
+
+def set_odds_matrix(rec_df):
+    """Set odds for every passer in every rotation, in one vectorized pass.
+
+    For each (Passer, Rotation) over in-system receptions (R#, R+, R!): how
+    often the set went to the OH after that player passed ('Was Set'/'Not
+    Set') and after anyone else passed ('Others ...'). Passer is the jersey
+    number as text, as entered for OH1/OH2.
+    """
+    decoded = decode_custom_codes(rec_df['Custom Code'])
+    eligible = (rec_df['Pass Grade'].isin(['R#', 'R+', 'R!']) & decoded['set_to'].notna()
+                & rec_df['Rotation'].isin(list(rotation_mapping)))
+    was_set = decoded['set_to'].astype(object) == decoded['OH'].astype(object)
+    frame = pd.DataFrame({
+        'Passer': player_keys(rec_df, 'Passer #')[eligible].astype(object),
+        'Rotation': rec_df['Rotation'][eligible].astype(object),
+        'Was Set': was_set[eligible].astype(int),
+    })
+    own = frame.groupby(['Passer', 'Rotation']).agg(**{'Was Set': ('Was Set', 'sum'), 'Receptions': ('Was Set', 'size')})
+    return _set_odds_from_counts(own)
+
+def _set_odds_from_counts(own):
+    # own: 'Was Set' and 'Receptions' per (Passer, Rotation) that has any
+    passers = sorted(own.index.get_level_values('Passer').unique(),
+                     key=lambda p: (not p.isdigit(), int(p) if p.isdigit() else 0, p))
+    index = pd.MultiIndex.from_product([passers, list(rotation_mapping)], names=['Passer', 'Rotation'])
+    odds = own.reindex(index, fill_value=0)
+    odds['Not Set'] = odds['Receptions'] - odds['Was Set']
+    totals = odds.groupby(level='Rotation')[['Was Set', 'Not Set']].sum()
+    others = totals.reindex(odds.index.get_level_values('Rotation')).to_numpy() - odds[['Was Set', 'Not Set']].to_numpy()
+    odds['Others Was Set'] = others[:, 0]
+    odds['Others Not Set'] = others[:, 1]
+    return _with_set_percentages(odds)
+
+def set_odds_view(matrix, player_num, z_codes):
+    """Rows of matrix for one passer in the given rotations, indexed by z_code.
+
+    A player who never passed in system gets zeros, with every reception in
+    those rotations counted under 'Others'.
+    """
+    totals = matrix.groupby(level='Rotation')[['Was Set', 'Not Set']].sum().reindex(list(z_codes), fill_value=0)
+    if player_num in matrix.index.get_level_values('Passer'):
+        return matrix.loc[player_num].reindex(list(z_codes), fill_value=0)
+    view = pd.DataFrame(0, index=totals.index, columns=['Was Set', 'Not Set'])
+    view['Others Was Set'] = totals['Was Set']
+    view['Others Not Set'] = totals['Not Set']
+    return _with_set_percentages(view)
+
+def set_odds_table(matrix, metric='Was Set %'):
+    """Pivot one set odds column into a passer x rotation table for display."""
+    table = matrix[metric].unstack('Rotation').reindex(columns=list(rotation_mapping))
+    return table.rename(columns=rotation_mapping)
+
+NO_ROWS = np.empty(0, dtype=np.intp)
+
+def _as_list(values):
+    return [values] if isinstance(values, (str, int)) else list(values)
+
+def _subtract_counts(counts, other):
+    # Counts that reach zero are dropped, so a sum that has had partials taken
+    # away reads exactly like one built without them. Counter's own -= would
+    # rescan every key for that; only other's keys can have changed.
+    counts.subtract(other)
+    for key in other:
+        if counts[key] <= 0:
+            del counts[key]
+
+class RunningTallies:
+    """Rotation tallies and set odds counts, updated one reception or transition row at a time.
+
+    tallies has the shape tally_rotations returns and set_odds() the
+    set_odds_matrix, for every row added so far. Each add costs the same
+    however many rows came before, which is what live mode needs.
+
+    They are also mergeable partial aggregates: a += b and a -= b add or take
+    away all of b's rows, so the tallies of any set of matches are the sum
+    of their per-match partials (see partial_tallies).
+    """
+
+    def __init__(self):
+        self.tallies = {
+            z_code: ({'R#': Counter(), 'R# or R+': Counter(), 'R!': Counter(), 'R-': Counter()}, Counter(), Counter())
+            for z_code in rotation_mapping
+        }
+        self.was_set = Counter()
+        self.receptions = Counter()
+
+    def add_reception(self, row):
+        _, z_code, passer, pass_grade, custom_code = row
+        if z_code not in self.tallies:
+            return
+        rec_tallies = self.tallies[z_code][0]
+        if pass_grade in ('R#', 'R+', 'R!'):
+            pattern = parse_in_system(custom_code)
+            if pattern is None:
+                return
+            key = tuple(pattern[col] for col in PATTERN_COLUMNS)
+            if pass_grade != 'R+':
+                rec_tallies[pass_grade][key] += 1
+            if pass_grade in ('R#', 'R+'):
+                rec_tallies['R# or R+'][key] += 1
+            self.receptions[str(passer), z_code] += 1
+            self.was_set[str(passer), z_code] += pattern['set_to'] == pattern['OH']
+        elif pass_grade == 'R-' and len(custom_code) == 1:
+            position = parse_out_of_system(custom_code)
+            if position is not None:
+                rec_tallies['R-'][position] += 1
+
+    def add_transition(self, row):
+        _, z_code, _, custom_code = row
+        if z_code not in self.tallies:
+            return
+        _, trans_in_system, trans_out_system = self.tallies[z_code]
+        pattern = parse_in_system(custom_code)
+        if pattern is not None:
+            trans_in_system[tuple(pattern[col] for col in PATTERN_COLUMNS)] += 1
+        elif len(custom_code) == 1 and (position := parse_out_of_system(custom_code)) is not None:
+            trans_out_system[position] += 1
+
+    @classmethod
+    def from_events(cls, receptions, transitions):
+        """A new RunningTallies over extracted reception and transition rows."""
+        tallies = cls()
+        for row in receptions:
+            tallies.add_reception(row)
+        for row in transitions:
+            tallies.add_transition(row)
+        return tallies
+
+    def to_json(self):
+        """The counts as JSON text, one [*key, count] list per entry; see from_json."""
+        def entries(counts):
+            return [[*key, count] if isinstance(key, tuple) else [key, count] for key, count in counts.items()]
+
+        return json.dumps({
+            'tallies': {
+                z_code: [{grade: entries(counts) for grade, counts in rec_tallies.items()},
+                         entries(trans_in_system), entries(trans_out_system)]
+                for z_code, (rec_tallies, trans_in_system, trans_out_system) in self.tallies.items()
+            },
+            'was_set': entries(self.was_set),
+            'receptions': entries(self.receptions),
+        })
+
+    @classmethod
+    def from_json(cls, text):
+        # Positions (R- and out-of-system transitions) are plain keys, everything else a tuple
+        def counts(entries, tuples=True):
+            return Counter({tuple(entry[:-1]) if tuples else entry[0]: entry[-1] for entry in entries})
+
+        data = json.loads(text)
+        tallies = cls()
+        for z_code, (rec_tallies, trans_in_system, trans_out_system) in data['tallies'].items():
+            tallies.tallies[z_code] = (
+                {grade: counts(entries, tuples=grade != 'R-') for grade, entries in rec_tallies.items()},
+                counts(trans_in_system),
+                counts(trans_out_system, tuples=False),
+            )
+        tallies.was_set = counts(data['was_set'])
+        tallies.receptions = counts(data['receptions'])
+        return tallies
+
+    @classmethod
+    def merged(cls, partials):
+        """A new RunningTallies holding the sum of partials."""
+        total = cls()
+        for partial in partials:
+            total += partial
+        return total
+
+    def _combine(self, other, combine):
+        for z_code, (rec_tallies, trans_in_system, trans_out_system) in other.tallies.items():
+            mine = self.tallies[z_code]
+            for grade, counts in rec_tallies.items():
+                combine(mine[0][grade], counts)
+            combine(mine[1], trans_in_system)
+            combine(mine[2], trans_out_system)
+        combine(self.was_set, other.was_set)
+        combine(self.receptions, other.receptions)
+        return self
+
+    def __iadd__(self, other):
+        return self._combine(other, Counter.update)
+
+    def __isub__(self, other):
+        return self._combine(other, _subtract_counts)
+
+    def set_odds(self):
+        own = pd.DataFrame(
+            {'Was Set': [self.was_set[key] for key in self.receptions], 'Receptions': list(self.receptions.values())},
+            index=pd.MultiIndex.from_arrays(
+                [[passer for passer, _ in self.receptions], [z_code for _, z_code in self.receptions]],
+                names=['Passer', 'Rotation'],
+            ),
+        )
+        return _set_odds_from_counts(own)
+
+def partial_tallies(rec_df, trans_df, rec_groups, trans_groups, groups):
+    """One RunningTallies per group, from grouped counts over the event tables.
+
+    rec_groups and trans_groups give each row's group (0 .. groups - 1),
+    e.g. the match it came from. Summing the partials of any set of groups
+    gives what tally_rotations and set_odds_matrix compute over their rows.
+    """
+    def counts(table, by):
+        # (*keys, count) per non-empty group, as plain lists: much faster to walk than Series.items()
+        return table.groupby(by, observed=True).size().reset_index().to_numpy().tolist()
+
+    partials = [RunningTallies() for _ in range(groups)]
+    rotations = list(rotation_mapping)
+    rec_rows = rec_df['Rotation'].isin(rotations).to_numpy()
+    rec = decode_custom_codes(rec_df['Custom Code'][rec_rows])
+    rec['Group'] = np.asarray(rec_groups)[rec_rows]
+    rec['Rotation'] = rec_df['Rotation'][rec_rows]
+    rec['Pass Grade'] = rec_df['Pass Grade'][rec_rows]
+    rec['Passer'] = player_keys(rec_df, 'Passer #')[rec_rows].astype(object)
+    in_system = rec[rec['Pass Grade'].isin(['R#', 'R+', 'R!']) & rec['set_to'].notna()]
+    for group, z_code, pass_grade, *pattern, count in counts(in_system, ['Group', 'Rotation', 'Pass Grade'] + PATTERN_COLUMNS):
+        rec_tallies = partials[group].tallies[z_code][0]
+        if pass_grade != 'R+':
+            rec_tallies[pass_grade][tuple(pattern)] += count
+        if pass_grade in ('R#', 'R+'):
+            rec_tallies['R# or R+'][tuple(pattern)] += count
+    for group, z_code, pos, count in counts(rec[rec['Pass Grade'] == 'R-'], ['Group', 'Rotation', 'Position']):
+        partials[group].tallies[z_code][0]['R-'][pos] += count
+    own = pd.DataFrame({
+        'Group': in_system['Group'], 'Passer': in_system['Passer'], 'Rotation': in_system['Rotation'],
+        'Was Set': (in_system['set_to'].astype(object) == in_system['OH'].astype(object)).astype(int),
+    }).groupby(['Group', 'Passer', 'Rotation'], observed=True)['Was Set'].agg(['sum', 'size'])
+    for group, passer, z_code, set_count, count in own.reset_index().to_numpy().tolist():
+        partials[group].was_set[passer, z_code] = set_count
+        partials[group].receptions[passer, z_code] = count
+
+    trans_rows = trans_df['Rotation'].isin(rotations).to_numpy()
+    trans = decode_custom_codes(trans_df['Custom Code'][trans_rows])
+    trans['Group'] = np.asarray(trans_groups)[trans_rows]
+    trans['Rotation'] = trans_df['Rotation'][trans_rows]
+    for group, z_code, *pattern, count in counts(trans, ['Group', 'Rotation'] + PATTERN_COLUMNS):
+        partials[group].tallies[z_code][1][tuple(pattern)] += count
+    for group, z_code, pos, count in counts(trans, ['Group', 'Rotation', 'Position']):
+        partials[group].tallies[z_code][2][pos] += count
+    return partials
+
+class LiveMatch:
+    """Follows a .dvw the scout is still writing, taking in only the lines appended since the last poll.
+
+    Keeps the byte offset, an unfinished last line, the tokenizer and
+    extractor state (the current *zN rotation and the open possession) and
+    RunningTallies between polls, so a rally costs the same to take in
+    however long the match has run. A file that shrinks is read again from
+    the start.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.match_date, self.home_team, self.away_team = "01.01", "Unknown Home", "Unknown Away"
+        self.receptions = []
+        self.transitions = []
+        self.running = RunningTallies()
+        self._partial = b''
+        self._header_records = []
+        self._tokenizer = DvwTokenizer()
+        self._extractor = EventExtractor(f"{self.match_date} {self.away_team}")
+
+    @property
+    def match_name(self):
+        return self._extractor.match_name
+
+    def poll(self):
+        """Take in the complete lines appended since the last poll; returns the number of new events."""
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < self.offset:
+                self.reset()
+            f.seek(self.offset)
+            data = f.read()
+        self.offset += len(data)
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        new_events = 0
+        for line in lines:
+            for record in self._tokenizer.feed(line.decode('ISO-8859-1')):
+                if record.kind in ('header', 'teams'):
+                    self._header_records.append(record)
+                    if record.kind == 'teams':
+                        self.match_date, self.home_team, self.away_team = header_from_records(self._header_records)
+                        self._extractor.match_name = f"{self.match_date} {self.away_team}"
+                    continue
+                event = self._extractor.add(record)
+                if event is None:
+                    continue
+                kind, row = event
+                if kind == 'reception':
+                    self.receptions.append(row)
+                    self.running.add_reception(row)
+                else:
+                    self.transitions.append(row)
+                    self.running.add_transition(row)
+                new_events += 1
+        return new_events
+
+class EventIndex:
+    """Reception and transition tables for many matches, indexed for cross-match queries.
+
+    Built once from (file hash, parse_match result) pairs in ingest order.
+    Each match's events are contiguous rows, so match, opponent and date
+    filters resolve to row ranges. Rotation, player and pass grade filters
+    use prebuilt value -> row position indexes. select() intersects these
+    instead of masking the tables. Selected rows keep ingest order, so they
+    read exactly like build_event_tables over just those matches. Each
+    match's RunningTallies from parse_match are kept as mergeable partials,
+    so tallies() over a set of matches is a sum rather than a recount.
+    """
+
+    def __init__(self, matches):
+        self.matches = pd.DataFrame(
+            [(key, match['match_name'], match['home_team'], match['away_team'], match['match_day'])
+             for key, match in matches],
+            columns=['Key', 'Match Name', 'Home Team', 'Opponent', 'Match Day'],
+        )
+        self.receptions, self.transitions = build_event_tables(
+            [row for _, match in matches for row in match['receptions']],
+            [row for _, match in matches for row in match['transitions']],
+        )
+        self._rec_bounds = np.cumsum([0] + [len(match['receptions']) for _, match in matches])
+        self._trans_bounds = np.cumsum([0] + [len(match['transitions']) for _, match in matches])
+        self._by_opponent = self.matches.groupby('Opponent').indices
+        dated = self.matches['Match Day'].dropna().sort_values(kind='stable')
+        self._by_day = dated.index.to_numpy()
+        self._days = dated.to_numpy()
+        self._rec_index = {
+            'rotation': self.receptions.groupby('Rotation', observed=True).indices,
+            'player': self.receptions.groupby(player_keys(self.receptions, 'Passer #')).indices,
+            'grade': self.receptions.groupby('Pass Grade', observed=True).indices,
+        }
+        self._trans_index = {
+            'rotation': self.transitions.groupby('Rotation', observed=True).indices,
+            'player': self.transitions.groupby(player_keys(self.transitions, 'Attacker #')).indices,
+        }
+        self._partials = [match.get('tallies') for _, match in matches]
+        self._last_total = None
+
+    def opponents(self):
+        return sorted(self._by_opponent)
+
+    def match_ids(self, opponents=None, date_range=None, last=None):
+        """Positions in self.matches of the matches against opponents, in ingest order.
+
+        date_range is an inclusive (start, end) pair of ISO dates, either of
+        which may be None; last keeps only the most recent matches. Matches
+        without a date are left out whenever date_range or last is given.
+        """
+        ids = np.arange(len(self.matches))
+        if opponents is not None:
+            ids = np.sort(np.concatenate([self._by_opponent.get(opponent, NO_ROWS) for opponent in _as_list(opponents)]
+                                         + [NO_ROWS]))
+        if date_range is None and last is None:
+            return ids
+        start, end = date_range or (None, None)
+        low = 0 if start is None else np.searchsorted(self._days, start, side='left')
+        high = len(self._days) if end is None else np.searchsorted(self._days, end, side='right')
+        by_day = self._by_day[low:high]
+        by_day = by_day[np.isin(by_day, ids)]
+        if last is not None:
+            by_day = by_day[max(len(by_day) - last, 0):]
+        return np.sort(by_day)
+
+    def partials(self):
+        """RunningTallies of each match in self.matches; any a match came without are counted on first use."""
+        if any(partial is None for partial in self._partials):
+            positions = np.arange(len(self.matches))
+            counted = partial_tallies(
+                self.receptions, self.transitions,
+                np.repeat(positions, np.diff(self._rec_bounds)), np.repeat(positions, np.diff(self._trans_bounds)),
+                len(self.matches),
+            )
+            self._partials = [counted[i] if partial is None else partial for i, partial in enumerate(self._partials)]
+        return self._partials
+
+    def tallies(self, opponents=None, date_range=None, last=None):
+        """RunningTallies summed over the matches match_ids selects.
+
+        The last sum is kept, and the next one starts from a copy of it when
+        only a few matches were added or taken away, such as one opponent
+        toggled in the app. Returned sums are never changed afterwards.
+        """
+        ids = set(self.match_ids(opponents, date_range, last).tolist())
+        partials = self.partials()
+        if self._last_total is not None:
+            last_ids, last_total = self._last_total
+            added, removed = ids - last_ids, last_ids - ids
+            if not added and not removed:
+                return last_total
+            if len(added) + len(removed) < len(ids):
+                total = RunningTallies.merged([last_total])
+                for i in added:
+                    total += partials[i]
+                for i in removed:
+                    total -= partials[i]
+                self._last_total = (ids, total)
+                return total
+        total = RunningTallies.merged(partials[i] for i in sorted(ids))
+        self._last_total = (ids, total)
+        return total
+
+    def _rows(self, bounds, ids, index, **filters):
+        if len(ids) == len(self.matches):
+            rows = np.arange(bounds[-1])
+        else:
+            rows = np.concatenate([np.arange(bounds[i], bounds[i + 1]) for i in ids] + [NO_ROWS])
+        for name, values in filters.items():
+            if values is None:
+                continue
+            keys = [str(value) for value in _as_list(values)] if name == 'player' else _as_list(values)
+            rows = np.intersect1d(rows, np.concatenate([index[name].get(key, NO_ROWS) for key in keys] + [NO_ROWS]))
+        return rows
+
+    def select(self, opponents=None, rotations=None, passer=None, attacker=None, grades=None, date_range=None,
+               last=None):
+        """Return (rec_df, trans_df, file hashes) for the events matching every given filter.
+
+        passer and grades only narrow the receptions and attacker only the
+        transitions; each filter takes one value or a list. The file hashes
+        are those of the selected matches, in ingest order.
+        """
+        ids = self.match_ids(opponents, date_range, last)
+        rec_rows = self._rows(self._rec_bounds, ids, self._rec_index, rotation=rotations, player=passer, grade=grades)
+        trans_rows = self._rows(self._trans_bounds, ids, self._trans_index, rotation=rotations, player=attacker)
+        return (
+            self.receptions.iloc[rec_rows].reset_index(drop=True),
+            self.transitions.iloc[trans_rows].reset_index(drop=True),
+            self.matches['Key'].iloc[ids].tolist(),
+        )
+
+    def query(self, opponents=None, rotations=None, passer=None, attacker=None, grades=None, date_range=None,
+              last=None):
+        """Tallies of the selected events, as tally_rotations returns them.
+
+        For example, the last five matches against one opponent:
+        index.query(opponents="UCLA", last=5). Without row filters this is
+        a sum of per-match partials.
+        """
+        if rotations is None and passer is None and attacker is None and grades is None:
+            return self.tallies(opponents, date_range, last).tallies
+        rec_df, trans_df, _ = self.select(opponents, rotations, passer, attacker, grades, date_range, last)
+        return tally_rotations(rec_df, trans_df, None if rotations is None else _as_list(rotations))
+
+# A cell value that needs an explicit number format in the write-only export
+StyledValue = namedtuple('StyledValue', ['value', 'number_format'])
+
+def _numeric_player(val):
+    if isinstance(val, (int, float)):
+        return float(val)
+    if isinstance(val, str) and val.strip().replace('-', '').replace('.', '').isdigit():
+        return float(val.strip())
+    return val
+
+def _rows_from_cells(cells):
+    """Turn a {(row, column): value} layout into (row, {column: value}) pairs in row order."""
+    rows = {}
+    for (row, column), value in cells.items():
+        rows.setdefault(row, {})[column] = value
+    return sorted(rows.items())
+
+def _write_rows(ws, *blocks):
+    """Stream side-by-side column blocks into a write-only worksheet.
+
+    Each block yields (row, {column: value}) in increasing row order; blocks
+    must not share columns. Rows are merged and appended strictly in order.
+    """
+    next_row = 1
+    # Each number format is looked up once; write-only cells are serialized as
+    # soon as their row is appended, so cells can share the resulting style
+    styles = {}
+    for row, group in groupby(heapq.merge(*blocks, key=itemgetter(0)), key=itemgetter(0)):
+        cells = {}
+        for _, block_cells in group:
+            cells.update(block_cells)
+        while next_row < row:
+            ws.append([])
+            next_row += 1
+        values = [None] * max(cells)
+        for column, value in cells.items():
+            if isinstance(value, StyledValue):
+                cell = WriteOnlyCell(ws, value=value.value)
+                if value.number_format in styles:
+                    cell._style = styles[value.number_format]
+                else:
+                    cell.number_format = value.number_format
+                    styles[value.number_format] = cell._style
+                value = cell
+            values[column - 1] = value
+        ws.append(values)
+        next_row += 1
+
+def _raw_data_rows(table, columns, player_column, first_column, title, headers):
+    yield 1, {first_column: title}
+    yield 2, {first_column + i: header for i, header in enumerate(headers)}
+    label_column = player_column.replace('#', 'Label')
+    players = (
+        _numeric_player(label) if pd.isna(number) else float(number)
+        for number, label in zip(table[player_column], table[label_column])
+    )
+    values = zip(*(players if column == player_column else table[column] for column in columns))
+    for r, data_row in enumerate(values, start=3):
+        yield r, {first_column + i: value for i, value in enumerate(data_row)}
+
+def _tally_rows(rec_tallies, trans_in_system, trans_out_system):
+    cells = {}
+    row = 1
+    for cat in ['R#', 'R# or R+', 'R!']:
+        cells[row, 1] = f'Reception {cat}'
+        row += 1
+        tallies = rec_tallies[cat]
+        if tallies:
+            for col, header in enumerate(['OH', 'MB', 'OPP/S', 'BR', 'Set To', 'Count'], start=1):
+                cells[row, col] = header
+            row += 1
+            for key, count in sorted(tallies.items(), key=lambda x: x[0]):
+                for col, value in enumerate(key, start=1):
+                    cells[row, col] = value
+                cells[row, 6] = float(count)
+                row += 1
+            row += 1
+
+    cells[row, 1] = 'Reception R-'
+    row += 1
+    out_system = rec_tallies['R-']
+    if out_system:
+        cells[row, 1] = 'Position'
+        cells[row, 2] = 'Count'
+        row += 1
+        for pos, count in sorted(out_system.items(), key=lambda x: x[0]):
+            cells[row, 1] = pos
+            cells[row, 2] = float(count)
+            row += 1
+        row += 1
+
+    cells[row, 1] = 'Transition In-System'
+    row += 1
+    if trans_in_system:
+        for col, header in enumerate(['OH', 'MB', 'OPP/S', 'BR', 'Set To', 'Count'], start=1):
+            cells[row, col] = header
+        row += 1
+        for key, count in sorted(trans_in_system.items(), key=lambda x: x[0]):
+            for col, value in enumerate(key, start=1):
+                cells[row, col] = value
+            cells[row, 6] = float(count)
+            row += 1
+        row += 1
+
+    cells[row, 1] = 'Transition OOS TR'
+    row += 1
+    if trans_out_system:
+        cells[row, 1] = 'Position'
+        cells[row, 2] = 'Count'
+        row += 1
+        for pos, count in sorted(trans_out_system.items(), key=lambda x: x[0]):
+            cells[row, 1] = pos
+            cells[row, 2] = float(count)
+            row += 1
+    return _rows_from_cells(cells)
+
+def _formatted_rows(shares):
+    # shares: one rotation's share_tables, {block: table}. Each pattern or
+    # position takes five rows; a pattern block with no patterns is left out.
+    row = 1
+    for cat in PATTERN_BLOCKS + POSITION_BLOCKS:
+        table = shares[cat]
+        if table.empty:
+            continue
+        yield row, {8: cat}
+        states = [POSITIONS] * len(table) if cat in POSITION_BLOCKS else table[POSITIONS].to_numpy().tolist()
+        counts = table[['Total'] + SET_COLUMNS].to_numpy(dtype=float).tolist()
+        # Real numbers, shown with two decimals like the set odds
+        percentages = [[StyledValue(share, '0.00') for share in block_shares]
+                       for block_shares in table[SHARE_COLUMNS].to_numpy().tolist()]
+        for block_states, block_counts, block_shares in zip(states, counts, percentages):
+            yield row + 1, dict(enumerate(block_states, start=9))
+            yield row + 2, dict(enumerate(block_counts, start=8))
+            yield row + 3, dict(enumerate(block_shares, start=9))
+            row += 5
+
+def _set_odds_rows(set_odds, oh1_num, oh2_num):
+    cells = {}
+
+    def calculate_set_odds(player_num, relevant_z_codes, rotation_labels, start_row):
+        cells[start_row, 1] = f"#{player_num} - Odds of Getting Set After a #{player_num} Reception"
+        cells[start_row + 1, 2] = f"After #{player_num} Passed In System"
+        cells[start_row + 1, 6] = f"After Someone Other #{player_num} Passed In System"
+        cells[start_row + 2, 2] = f"#{player_num} Was Set"
+        cells[start_row + 2, 3] = f"#{player_num} Not Set"
+        cells[start_row + 2, 4] = f"#{player_num} Was Set %"
+        cells[start_row + 2, 6] = f"#{player_num} Was Set"
+        cells[start_row + 2, 7] = f"#{player_num} Not Set"
+        cells[start_row + 2, 8] = f"#{player_num} Was Set %"
+
+        view = set_odds_view(set_odds, player_num, relevant_z_codes)
+        row = start_row + 3
+        for rot_name, z_code in zip(rotation_labels, relevant_z_codes):
+            odds = view.loc[z_code]
+            cells[row, 1] = rot_name
+            cells[row, 2] = odds['Was Set']
+            cells[row, 3] = odds['Not Set']
+            cells[row, 4] = StyledValue(odds['Was Set %'], '0.00')
+            cells[row, 6] = odds['Others Was Set']
+            cells[row, 7] = odds['Others Not Set']
+            cells[row, 8] = StyledValue(odds['Others Was Set %'], '0.00')
+            row += 1
+
+        totals = _with_set_percentages(view.sum().to_frame().T).iloc[0]
+        cells[row, 1] = "Tot"
+        cells[row, 2] = totals['Was Set']
+        cells[row, 3] = totals['Not Set']
+        cells[row, 4] = StyledValue(totals['Was Set %'], '0.00')
+        cells[row, 6] = totals['Others Was Set']
+        cells[row, 7] = totals['Others Not Set']
+        cells[row, 8] = StyledValue(totals['Others Was Set %'], '0.00')
+
+        return row + 2
+
+    oh1_rotations = [('*z1', 'Rot 1'), ('*z3', 'Rot 5'), ('*z2', 'Rot 6')]
+    oh1_z_codes, oh1_labels = zip(*oh1_rotations)
+    next_row = calculate_set_odds(oh1_num, oh1_z_codes, oh1_labels, 1)
+
+    oh2_rotations = [('*z6', 'Rot 2'), ('*z5', 'Rot 3'), ('*z4', 'Rot 4')]
+    oh2_z_codes, oh2_labels = zip(*oh2_rotations)
+    calculate_set_odds(oh2_num, oh2_z_codes, oh2_labels, next_row)
+    return _rows_from_cells(cells)
+
+def create_excel_in_memory(rec_df, trans_df, oh1_num, oh2_num, home_team, profiler=NULL_PROFILER, set_odds=None,
+                           tallies=None, progress=None):
+    """Build the analysis workbook from the reception and transition tables and return it as a BytesIO.
+
+    Uses a write-only workbook: each sheet is streamed row by row, with the
+    tally (A-F), formatted (H-L) and raw data (N-R, T-W) blocks merged in
+    row order, so the raw rows never sit in memory as cells. set_odds and
+    tallies are a precomputed set_odds_matrix(rec_df) and
+    tally_rotations(rec_df, trans_df), if the caller already has them.
+    progress, if given, is called as progress(step, steps, sheet_name)
+    before each sheet and before saving; it may raise to stop the build.
+    """
+    steps = len(rotation_mapping) + 2
+    rotation_tallies = tallies
+    if rotation_tallies is None:
+        with profiler.stage('analyze tallies') as stage:
+            rotation_tallies = tally_rotations(rec_df, trans_df)
+            stage['rows'] = len(rec_df) + len(trans_df)
+    wb = Workbook(write_only=True)
+
+    def checkpoint(step, sheet_name):
+        if progress is None:
+            return
+        try:
+            progress(step, steps, sheet_name)
+        except BaseException:
+            # An abandoned write-only workbook still has every sheet streaming to a temp file
+            for ws in wb.worksheets:
+                ws.close()
+                ws._writer.cleanup()
+            raise
+
+    rec_rows = rec_df.groupby('Rotation', observed=True).indices
+    trans_rows = trans_df.groupby('Rotation', observed=True).indices
+    with profiler.stage('share tables'):
+        shares = share_tables(rotation_tallies)
+
+    for step, (z_code, sheet_name) in enumerate(rotation_mapping.items()):
+        checkpoint(step, sheet_name)
+        with profiler.stage('write sheet', sheet_name) as stage:
+            ws = wb.create_sheet(sheet_name)
+            rotation_rec = rec_df.iloc[rec_rows.get(z_code, NO_ROWS)]
+            rotation_trans = trans_df.iloc[trans_rows.get(z_code, NO_ROWS)]
+            rec_tallies, trans_in_system, trans_out_system = rotation_tallies[z_code]
+            _write_rows(
+                ws,
+                _tally_rows(rec_tallies, trans_in_system, trans_out_system),
+                _formatted_rows(shares[z_code]),
+                _raw_data_rows(rotation_rec, RECEPTION_COLUMNS, 'Passer #', 14, 'Reception Raw Data',
+                               ['Match Name', 'Rotation', 'Passer #', 'Pass Grade', 'Custom Code']),
+                _raw_data_rows(rotation_trans, TRANSITION_COLUMNS, 'Attacker #', 20, 'Transition Raw Data',
+                               ['Match Name', 'Rotation', 'Attacker #', 'Custom Code']),
+            )
+            stage['rows'] = len(rotation_rec) + len(rotation_trans)
+
+    checkpoint(steps - 2, "Set Odds")
+    with profiler.stage('write sheet', "Set Odds"):
+        if set_odds is None:
+            set_odds = set_odds_matrix(rec_df)
+        _write_rows(wb.create_sheet("Set Odds"), _set_odds_rows(set_odds, oh1_num, oh2_num))
+
+    checkpoint(steps - 1, None)
+    with profiler.stage('save workbook'):
+        output = BytesIO()
+        wb.save(output)
+        output.seek(0)
+    return output
+
+# Columnar export formats and their file extensions
+EXPORT_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow', 'csv': '.csv'}
+
+def _block_tables(rotation_tallies, blocks):
+    tables = []
+    for z_code, tallies in rotation_tallies.items():
+        by_block = sheet_blocks(*tallies)
+        for block in blocks:
+            table = tally_table(block, by_block[block])
+            table.insert(0, 'Block', block)
+            table.insert(0, 'Rotation', z_code)
+            tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+def export_tables(rec_df, trans_df, rotation_tallies=None, set_odds=None):
+    """The workbook's data as flat tables for columnar export, keyed by file stem.
+
+    receptions and transitions are the raw rows, pattern_tallies and
+    position_tallies every rotation's tally blocks in long form, and
+    set_odds the full set_odds_matrix, one row per passer and rotation.
+    """
+    if rotation_tallies is None:
+        rotation_tallies = tally_rotations(rec_df, trans_df)
+    if set_odds is None:
+        set_odds = set_odds_matrix(rec_df)
+    return {
+        'receptions': rec_df.reset_index(drop=True),
+        'transitions': trans_df.reset_index(drop=True),
+        'pattern_tallies': _block_tables(rotation_tallies, PATTERN_BLOCKS),
+        'position_tallies': _block_tables(rotation_tallies, POSITION_BLOCKS),
+        'set_odds': set_odds.reset_index(),
+    }
+
+def write_table(table, fmt, target):
+    """Write one export table to a path or binary file object as 'parquet', 'arrow' (IPC file) or 'csv'."""
+    if fmt == 'parquet':
+        table.to_parquet(target, index=False)
+    elif fmt == 'arrow':
+        # Feather v2 is the Arrow IPC file format
+        table.to_feather(target)
+    elif fmt == 'csv':
+        table.to_csv(target, index=False)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+def export_archive(tables, fmt, profiler=NULL_PROFILER):
+    """Zip the export tables, one file per table in fmt, and return the archive bytes."""
+    output = BytesIO()
+    # Parquet and Arrow are compressed or binary already; only CSV gains from deflate
+    compression = zipfile.ZIP_DEFLATED if fmt == 'csv' else zipfile.ZIP_STORED
+    with zipfile.ZipFile(output, 'w', compression) as archive:
+        for name, table in tables.items():
+            with profiler.stage('write table', f"{name}{EXPORT_FORMATS[fmt]}") as stage:
+                buffer = BytesIO()
+                write_table(table, fmt, buffer)
+                archive.writestr(f"{name}{EXPORT_FORMATS[fmt]}", buffer.getvalue())
+                stage['rows'] = len(table)
+    return output.getvalue()
+
+def report_key(file_keys, opponents, oh1_num, oh2_num, home_team, stale_keys=()):
+    """Hash of everything a workbook depends on.
+
+    file_keys are the file hashes of the matches in the report, in the order
+    their events were collected, since that is the order of the raw data rows.
+    stale_keys are those whose events were parsed under an older EVENTS_VERSION;
+    the same file gives different events once it is re-parsed.
+    """
+    inputs = [list(file_keys), sorted(opponents), oh1_num, oh2_num, home_team,
+              sorted(set(file_keys) & set(stale_keys))]
+    return hashlib.sha256(json.dumps(inputs).encode('utf-8')).hexdigest()
+
+class ReportCache:
+    """Thread-safe LRU of generated workbook bytes keyed by report_key, bounded by total size.
+
+    One instance is shared by every session on the server. A workbook larger
+    than the whole budget is never cached.
+    """
+
+    def __init__(self, max_bytes=REPORT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+class ReportCancelled(Exception):
+    """Raised inside a report build whose job has been cancelled."""
+
+class ReportJob:
+    """One background workbook build: status, per-sheet progress, cancellation and the result bytes.
+
+    status moves from 'queued' to 'running' to 'done', 'cancelled' or
+    'failed'. Pass report as the progress callback of create_excel_in_memory;
+    it raises ReportCancelled at the next sheet once the job is cancelled.
+    """
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'queued'
+        self.step = 0
+        self.steps = 1
+        self.sheet_name = None
+        self.result = None
+        self.error = None
+        self.records = []
+        self.watchers = 1
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in ('done', 'cancelled', 'failed')
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def progress(self):
+        return 1.0 if self.status == 'done' else self.step / self.steps
+
+    def report(self, step, steps, sheet_name):
+        if self.cancelled:
+            raise ReportCancelled(self.id)
+        self.step, self.steps, self.sheet_name = step, steps, sheet_name
+
+class ReportJobManager:
+    """Runs workbook builds as background jobs on a shared thread pool.
+
+    There is at most one live job per report key: asking for a report that
+    is already being built joins that job, and one that is in cache comes
+    back as a finished job, so no build is done twice. Results also go into
+    cache. Only the most recent max_finished finished jobs are kept.
+    """
+
+    def __init__(self, cache, max_workers=REPORT_JOB_WORKERS, max_finished=64):
+        self.cache = cache
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def submit(self, key, build):
+        """Start or join the job for report key; build(job) returns the workbook bytes."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.key == key and not job.done and not job.cancelled:
+                    job.watchers += 1
+                    return job
+            job = ReportJob(key)
+            self._jobs[job.id] = job
+            cached = self.cache.get(key)
+            if cached is not None:
+                job.result = cached
+                job.status = 'done'
+            else:
+                job.future = self._executor.submit(self._run, job, build)
+            finished = [job_id for job_id, other in self._jobs.items() if other.done]
+            for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+                del self._jobs[job_id]
+        return job
+
+    def cancel(self, job_id):
+        """Stop waiting for a job; its build is cancelled once nobody else is waiting for it."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return
+            job.watchers -= 1
+            if job.watchers > 0:
+                return
+            job._cancelled.set()
+            if job.future.cancel():
+                job.status = 'cancelled'
+
+    def _run(self, job, build):
+        job.status = 'running'
+        try:
+            job.result = build(job)
+        except ReportCancelled:
+            job.status = 'cancelled'
+            return
+        except Exception as exc:
+            logger.exception(f"Report build {job.id} failed")
+            job.error = str(exc)
+            job.status = 'failed'
+            return
+        self.cache.put(job.key, job.result)
+        job.status = 'done'
+
+### Headless Batch Reports
+def write_team_report(team, receptions, transitions, oh1_num, oh2_num, out_dir, profile=False, formats=('xlsx',),
+                      partials=None):
+    """Write one team's report to out_dir in each of formats; returns (written paths, profile records).
+
+    'xlsx' is the '<team> Analysis.xlsx' workbook; the EXPORT_FORMATS write
+    one file per export table under '<team>/'. partials are the matches'
+    RunningTallies, if the caller has them; their sum replaces a recount.
+    """
+    profiler = PipelineProfiler(enabled=profile)
+    with profiler.stage('build tables', team) as stage:
+        rec_df, trans_df = build_event_tables(receptions, transitions)
+        stage['rows'] = len(rec_df) + len(trans_df)
+    totals = None if partials is None else RunningTallies.merged(partials)
+    with profiler.stage('analyze tallies', team) as stage:
+        rotation_tallies = tally_rotations(rec_df, trans_df) if totals is None else totals.tallies
+        stage['rows'] = len(rec_df) + len(trans_df)
+    with profiler.stage('set odds matrix', team) as stage:
+        set_odds = set_odds_matrix(rec_df) if totals is None else totals.set_odds()
+        stage['rows'] = len(set_odds)
+    written = []
+    if 'xlsx' in formats:
+        excel_file = create_excel_in_memory(rec_df, trans_df, oh1_num, oh2_num, team, profiler, set_odds, rotation_tallies)
+        path = Path(out_dir) / f"{team} Analysis.xlsx"
+        path.write_bytes(excel_file.getvalue())
+        written.append(path)
+    columnar = [fmt for fmt in formats if fmt in EXPORT_FORMATS]
+    if columnar:
+        tables = export_tables(rec_df, trans_df, rotation_tallies, set_odds)
+        team_dir = Path(out_dir) / team
+        team_dir.mkdir(parents=True, exist_ok=True)
+        for fmt in columnar:
+            for name, table in tables.items():
+                path = team_dir / f"{name}{EXPORT_FORMATS[fmt]}"
+                with profiler.stage('write table', path.name) as stage:
+                    write_table(table, fmt, path)
+                    stage['rows'] = len(table)
+                written.append(path)
+    return written, profiler.records
+
+def run_batch(dvw_dir, config_path, out_dir, workers=None, store_path=None, profiler=NULL_PROFILER,
+              formats=('xlsx',)):
+    """Build the analysis report for every configured home team found in dvw_dir.
+
+    config_path is a JSON object mapping team name to {"oh1": ..., "oh2": ...}.
+    formats are 'xlsx' and any of EXPORT_FORMATS, as for write_team_report.
+    Returns the list of written report paths.
+    """
+    config = json.loads(Path(config_path).read_text())
+    paths = sorted(Path(dvw_dir).rglob('*.dvw'))
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    store = SeasonStore(store_path) if store_path else None
+
+    with make_ingest_pool(workers) as executor:
+        with profiler.stage('read files') as stage:
+            blobs = [path.read_bytes() for path in paths]
+            stage['rows'] = len(blobs)
+        matches = ingest_matches(
+            blobs, executor=executor, store=store, names=[path.name for path in paths], profiler=profiler,
+        )
+        by_team = {}
+        for match in matches:
+            by_team.setdefault(match['home_team'], []).append(match)
+        logger.info(f"Parsed {len(paths)} files for {len(by_team)} home teams")
+
+        futures = []
+        for team, team_matches in sorted(by_team.items()):
+            settings = config.get(team)
+            if not settings:
+                logger.warning(f"No OH1/OH2 settings for '{team}' in {config_path}; skipping {len(team_matches)} files.")
+                continue
+            receptions = [row for match in team_matches for row in match['receptions']]
+            transitions = [row for match in team_matches for row in match['transitions']]
+            futures.append(executor.submit(
+                write_team_report, team, receptions, transitions,
+                str(settings['oh1']), str(settings['oh2']), out_dir, profiler.enabled, tuple(formats),
+                [match['tallies'] for match in team_matches],
+            ))
+        written = []
+        for future in futures:
+            team_paths, records = future.result()
+            profiler.records.extend(records)
+            written.extend(team_paths)
+            for path in team_paths:
+                logger.info(f"Wrote {path}")
+    return written
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Generate scouting workbooks for every home team in a folder of .dvw files.")
+    parser.add_argument("dvw_dir", help="directory searched recursively for .dvw files")
+    parser.add_argument("--config", required=True, help='JSON file: {"<team>": {"oh1": "<number>", "oh2": "<number>"}}')
+    parser.add_argument("--out-dir", default="reports", help="where to write '<team> Analysis.xlsx' files")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--store", default=None, help="season store to reuse and extend (default: none)")
+    parser.add_argument("--profile", default=None, metavar="JSON", help="write per-stage timings and peak memory here")
+    parser.add_argument("--formats", nargs='+', default=['xlsx'], choices=['xlsx'] + list(EXPORT_FORMATS),
+                        help="report formats; parquet, arrow and csv write one file per table to '<team>/'")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    profiler = PipelineProfiler(enabled=args.profile is not None)
+    run_batch(args.dvw_dir, args.config, args.out_dir, workers=args.workers, store_path=args.store, profiler=profiler,
+              formats=args.formats)
+    if args.profile:
+        Path(args.profile).write_text(profiler.to_json())
+    return 0